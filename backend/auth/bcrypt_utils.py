@@ -1,7 +1,75 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from bcrypt import hashpw, gensalt, checkpw
+from shared.config import BCRYPT_ROUNDS, BCRYPT_MAX_CONCURRENCY, BCRYPT_MAX_QUEUE
+
+# Password hashing is CPU bound. It runs on a small dedicated pool so a burst
+# of logins or signups can only occupy BCRYPT_MAX_CONCURRENCY cores per
+# process, and callers beyond BCRYPT_MAX_QUEUE are turned away immediately
+# instead of piling up behind the pool.
+
+class PasswordHasherBusy(Exception):
+    """Raised when too many password operations are already waiting"""
+
+_executor = ThreadPoolExecutor(max_workers=BCRYPT_MAX_CONCURRENCY, thread_name_prefix="bcrypt")
+_lock = threading.Lock()
+_metrics = {
+    "queued": 0,
+    "rejected": 0,
+    "completed": 0,
+    "total_hash_seconds": 0.0,
+    "max_hash_seconds": 0.0,
+    "total_wait_seconds": 0.0,
+}
+
+def _timed(func, submitted_at, *args):
+    started = time.monotonic()
+    try:
+        return func(*args)
+    finally:
+        finished = time.monotonic()
+        with _lock:
+            _metrics["completed"] += 1
+            _metrics["total_hash_seconds"] += finished - started
+            _metrics["max_hash_seconds"] = max(_metrics["max_hash_seconds"], finished - started)
+            _metrics["total_wait_seconds"] += started - submitted_at
+
+def _run(func, *args):
+    with _lock:
+        if _metrics["queued"] >= BCRYPT_MAX_QUEUE:
+            _metrics["rejected"] += 1
+            raise PasswordHasherBusy("Too many password operations in progress")
+        _metrics["queued"] += 1
+    try:
+        return _executor.submit(_timed, func, time.monotonic(), *args).result()
+    finally:
+        with _lock:
+            _metrics["queued"] -= 1
 
 def hash_password(password):
-    return hashpw(password.encode(), gensalt()).decode()
+    return _run(lambda: hashpw(password.encode(), gensalt(rounds=BCRYPT_ROUNDS)).decode())
 
 def check_password(password, hashed):
-    return checkpw(password.encode(), hashed.encode())
+    return _run(lambda: checkpw(password.encode(), hashed.encode()))
+
+def needs_rehash(hashed):
+    """True when a stored hash was made with a different cost than BCRYPT_ROUNDS"""
+    try:
+        return int(hashed.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+def hashing_metrics():
+    """Queue depth and latency of password operations in this process"""
+    with _lock:
+        completed = _metrics["completed"]
+        return {
+            "queue_depth": _metrics["queued"],
+            "max_concurrency": BCRYPT_MAX_CONCURRENCY,
+            "rejected": _metrics["rejected"],
+            "completed": completed,
+            "avg_hash_seconds": _metrics["total_hash_seconds"] / completed if completed else 0.0,
+            "max_hash_seconds": _metrics["max_hash_seconds"],
+            "avg_wait_seconds": _metrics["total_wait_seconds"] / completed if completed else 0.0,
+        }
@@ -1,7 +1,70 @@
-from flask_jwt_extended import create_access_token, decode_token
+from bson import ObjectId
+from flask_jwt_extended import create_access_token, decode_token, get_jwt, get_jwt_identity
+from auth.models import User
+from users.models import UserService
+from shared.cache import TTLCache
+from shared.config import TOKEN_VERSION_CACHE_TTL
 
-def generate_token(identity):
-    return create_access_token(identity=identity)
+# user_id -> token_version, so the revocation check rarely touches the database
+token_version_cache = TTLCache(4096, TOKEN_VERSION_CACHE_TTL)
+
+# Stored for users that no longer exist: no token version can match it
+MISSING_USER = -1
+
+def generate_token(user):
+    """Access token for user, carrying the claims routes need to skip a user lookup"""
+    return create_access_token(
+        identity=user["email"],
+        additional_claims={
+            "user_id": str(user["_id"]),
+            "role": user["role"],
+            "name": user["name"],
+            "token_version": user.get("token_version", 0)
+        }
+    )
 
 def decode_jwt(token):
     return decode_token(token)
+
+def get_current_user():
+    """
+    The caller of a protected route, built from the token claims.
+    Tokens issued before the claims existed fall back to a user lookup.
+    """
+    claims = get_jwt()
+    if "user_id" not in claims:
+        return UserService.get_user_by_email(get_jwt_identity())
+    return {
+        "_id": ObjectId(claims["user_id"]),
+        "email": get_jwt_identity(),
+        "name": claims["name"],
+        "role": claims["role"]
+    }
+
+def get_current_author():
+    """
+    The caller of a route that copies their name or email into a document.
+    The name claim is fixed when the token is issued, so it is not used here:
+    a token from before a profile change would bring the old name back after
+    propagation replaced it.
+    """
+    return UserService.get_snapshot_source(get_jwt_identity())
+
+def get_token_version(user_id):
+    version = token_version_cache.get(user_id)
+    if version is None:
+        version = User.get_token_version(user_id)
+        version = MISSING_USER if version is None else version
+        token_version_cache.set(user_id, version)
+    return version
+
+def is_token_revoked(jwt_header, jwt_payload):
+    """Registered as the JWTManager blocklist loader"""
+    if "token_version" not in jwt_payload:
+        return False
+    return get_token_version(jwt_payload["user_id"]) != jwt_payload["token_version"]
+
+def revoke_tokens(user_id):
+    """Invalidate every token issued to user_id, e.g. after a role or password change"""
+    User.bump_token_version(user_id)
+    token_version_cache.invalidate(str(user_id))
@@ -1,6 +1,9 @@
 from shared.database import mongo
+from users.models import UserService
 from marshmallow import Schema, fields, ValidationError
 from datetime import datetime
+from bson import ObjectId
+import hashlib
 
 class UserSchema(Schema):
     name = fields.String(required=True)
@@ -21,25 +24,57 @@ class User:
     
     @staticmethod
     def create_user(user_data):
-        # Create unique index for email
-        mongo.db.users.create_index("email", unique=True)
+        # The unique email index is declared in shared/indexes.py
+        user_data.update(UserService.search_fields(user_data))
         return mongo.db.users.insert_one(user_data)
 
     @staticmethod
-    def update_reset_token(email, token, expiration):
+    def get_token_version(user_id):
+        """Current token_version of a user, or None if the user does not exist"""
+        user = mongo.db.users.find_one({"_id": ObjectId(user_id)}, {"token_version": 1})
+        return user.get("token_version", 0) if user else None
+
+    @staticmethod
+    def bump_token_version(user_id):
         return mongo.db.users.update_one(
-            {"email": email},
-            {
-                "$set": {
-                    "reset_token": token,
-                    "reset_token_expires": expiration
-                }
-            }
+            {"_id": ObjectId(user_id)},
+            {"$inc": {"token_version": 1}}
+        )
+
+    @staticmethod
+    def hash_reset_token(token):
+        """Reset tokens are only stored as their SHA-256, which is also the _id"""
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    @staticmethod
+    def create_reset_token(user, token, expiration):
+        """Store a reset token for user, replacing any earlier one"""
+        mongo.db.password_reset_tokens.delete_many({"user_id": user["_id"]})
+        return mongo.db.password_reset_tokens.insert_one({
+            "_id": User.hash_reset_token(token),
+            "user_id": user["_id"],
+            "email": user["email"],
+            "expires_at": expiration,
+            "created_at": datetime.utcnow()
+        })
+
+    @staticmethod
+    def consume_reset_token(token):
+        """
+        Look up a reset token by its hash and delete it in the same operation,
+        so it can only be used once. Expired tokens are removed by a TTL index.
+        """
+        return mongo.db.password_reset_tokens.find_one_and_delete(
+            {"_id": User.hash_reset_token(token)}
         )
 
     @staticmethod
-    def find_by_reset_token(token):
-        return mongo.db.users.find_one({"reset_token": token})
+    def remove_legacy_reset_tokens():
+        """Drop plaintext reset tokens stored on user documents before the dedicated collection"""
+        return mongo.db.users.update_many(
+            {"reset_token": {"$exists": True}},
+            {"$unset": {"reset_token": "", "reset_token_expires": ""}}
+        )
 
     @staticmethod
     def update_password(email, new_password):
@@ -51,13 +86,8 @@ class User:
         )
 
     @staticmethod
-    def clear_reset_token(email):
+    def update_password_by_id(user_id, new_password):
         return mongo.db.users.update_one(
-            {"email": email},
-            {
-                "$unset": {
-                    "reset_token": "",
-                    "reset_token_expires": ""
-                }
-            }
+            {"_id": ObjectId(user_id)},
+            {"$set": {"password": new_password}}
         )
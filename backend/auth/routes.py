@@ -1,13 +1,26 @@
 from flask import Blueprint, request, jsonify, current_app
-from flask_jwt_extended import jwt_required, create_access_token
+from flask_jwt_extended import jwt_required
 from auth.models import User
-from auth.bcrypt_utils import hash_password, check_password
+from auth.bcrypt_utils import hash_password, check_password, needs_rehash, PasswordHasherBusy
+from auth.jwt_utils import generate_token, revoke_tokens
 from marshmallow import Schema, fields, ValidationError
 from datetime import datetime, timedelta
 import secrets
+from shared.ratelimit import create_rate_limiter
+from shared.config import (
+    RATE_LIMIT_BACKEND, RATE_LIMIT_TRUST_FORWARDED,
+    LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE, LOGIN_ACCOUNT_BURST, LOGIN_ACCOUNT_PER_MINUTE
+)
 
 auth = Blueprint("auth", __name__)
 
+login_limiter = create_rate_limiter(RATE_LIMIT_BACKEND)
+
+@auth.errorhandler(PasswordHasherBusy)
+def password_hasher_busy(error):
+    # Shed load instead of queueing more bcrypt work behind a saturated pool
+    return jsonify({"error": "Authentication service is busy, please retry"}), 503, {"Retry-After": "1"}
+
 @auth.route("/auth/signup", methods=["POST"])
 def signup():
     data = request.get_json()
@@ -38,18 +51,53 @@ def signup():
     User.create_user(validated_data)
     return jsonify({"message": "User created successfully"}), 201
 
+def client_ip():
+    if RATE_LIMIT_TRUST_FORWARDED and request.access_route:
+        return request.access_route[0]
+    return request.remote_addr
+
+def login_account_key(email):
+    return f"login:account:{str(email).strip().lower()}"
+
+def throttle_login(email):
+    """
+    Take a token from the caller's IP bucket and the account's bucket.
+    Returns a 429 response when either is empty, before any database or bcrypt work.
+    """
+    checks = (
+        (f"login:ip:{client_ip()}", LOGIN_IP_BURST, LOGIN_IP_PER_MINUTE / 60),
+        (login_account_key(email), LOGIN_ACCOUNT_BURST, LOGIN_ACCOUNT_PER_MINUTE / 60),
+    )
+    for key, capacity, rate in checks:
+        allowed, retry_after = login_limiter.consume(key, capacity, rate)
+        if not allowed:
+            return jsonify({"error": "Too many login attempts, please try again later"}), 429, \
+                {"Retry-After": str(retry_after)}
+    return None
+
 @auth.route("/auth/login", methods=["POST"])
 def login():
     data = request.get_json()
     email = data.get("email")
     password = data.get("password")
 
+    throttled = throttle_login(email)
+    if throttled:
+        return throttled
+
     user = User.find_by_email(email)
     if not user or not check_password(password, user["password"]):
         return jsonify({"error": "Invalid email or password"}), 401
 
-    # Create access token with email identity
-    access_token = create_access_token(identity=email)
+    # A successful login clears the account's failed attempts
+    login_limiter.reset(login_account_key(email))
+
+    # Transparently upgrade hashes made with a different cost factor
+    if needs_rehash(user["password"]):
+        User.update_password(email, hash_password(password))
+
+    # Email identity plus user_id, role and name claims
+    access_token = generate_token(user)
     
     # Prepare user data for response (excluding password)
     user_data = {
@@ -79,7 +127,7 @@ def forgot_password():
     expiration = datetime.utcnow() + timedelta(hours=1)
 
     # Store reset token and expiration in database
-    User.update_reset_token(email, reset_token, expiration)
+    User.create_reset_token(user, reset_token, expiration)
 
     # TODO: Send email with reset link
     # reset_link = f"https://yourfrontend.com/reset-password?token={reset_token}"
@@ -102,17 +150,20 @@ def reset_password(token):
     if new_password != confirm_password:
         return jsonify({"error": "Passwords do not match"}), 400
 
-    # Find user by reset token and verify it's not expired
-    user = User.find_by_reset_token(token)
-    if not user:
+    # Find the reset token (removing it) and verify it's not expired
+    reset = User.consume_reset_token(token)
+    if not reset:
         return jsonify({"error": "Invalid or expired reset token"}), 400
 
-    if datetime.utcnow() > user["reset_token_expires"]:
+    # The TTL monitor runs about once a minute, so check expiry here too
+    if datetime.utcnow() > reset["expires_at"]:
         return jsonify({"error": "Reset token has expired"}), 400
 
-    # Update password and clear reset token
+    # Update password
     hashed_password = hash_password(new_password)
-    User.update_password(user["email"], hashed_password)
-    User.clear_reset_token(user["email"])
+    # By ID: the email may have changed since the token was issued
+    if User.update_password_by_id(reset["user_id"], hashed_password).matched_count == 0:
+        return jsonify({"error": "User not found"}), 404
+    revoke_tokens(reset["user_id"])
 
     return jsonify({"message": "Password has been reset successfully"}), 200
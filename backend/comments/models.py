@@ -1,7 +1,12 @@
 from datetime import datetime
 from bson import ObjectId
 from marshmallow import Schema, fields, validate
+from pymongo import UpdateOne
 from shared.database import mongo
+from shared.pagination import paginate
+from shared.tasks import task, enqueue
+from projects.models import Project
+from notifications.models import Notification
 
 class ReplySchema(Schema):
     id = fields.Str(dump_only=True)
@@ -20,6 +25,7 @@ class CommentSchema(Schema):
     user_name = fields.Str(required=True)
     user_email = fields.Str(required=True)
     replies = fields.List(fields.Nested(ReplySchema()), dump_only=True)
+    reply_count = fields.Int(dump_only=True)
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
 
@@ -27,8 +33,17 @@ class Comment:
     schema = CommentSchema()
     reply_schema = ReplySchema()
 
+    # Replies live in the comment_replies collection; each comment document
+    # only caches its reply_count and its latest_replies most recent replies.
+    latest_replies = 3
+
     @staticmethod
     def create_comment(project_id, user_id, text, user_data):
+        """
+        Insert a comment and return the stored document. Notifying the
+        project team is queued, so this is the only write the caller waits on
+        besides the outbox entry.
+        """
         comment_data = {
             'project_id': ObjectId(project_id),
             'user_id': ObjectId(user_id),
@@ -36,16 +51,40 @@ class Comment:
             'user_name': user_data.get('name'),
             'user_email': user_data.get('email'),
             'replies': [],
+            'reply_count': 0,
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         }
-        result = mongo.db.comments.insert_one(comment_data)
-        return str(result.inserted_id)
+        mongo.db.comments.insert_one(comment_data)
+        try:
+            enqueue('comment_created', {
+                'comment_id': str(comment_data['_id']),
+                'project_id': project_id,
+                'user_id': user_id,
+                'user_name': user_data.get('name')
+            })
+        except Exception as e:
+            # The comment is stored; failing here would only make clients post it again
+            print(f"Error scheduling comment notifications: {str(e)}")
+        return comment_data
+
+    @staticmethod
+    def cached_reply(reply):
+        """The copy of a comment_replies document kept on its comment"""
+        return {
+            'id': str(reply['_id']),
+            'user_id': reply['user_id'],
+            'text': reply['text'],
+            'user_name': reply['user_name'],
+            'user_email': reply['user_email'],
+            'created_at': reply['created_at'],
+            'updated_at': reply['updated_at']
+        }
 
     @staticmethod
     def add_reply(comment_id, user_id, text, user_data):
         reply = {
-            'id': str(ObjectId()),
+            'comment_id': ObjectId(comment_id),
             'user_id': ObjectId(user_id),
             'text': text,
             'user_name': user_data.get('name'),
@@ -53,31 +92,141 @@ class Comment:
             'created_at': datetime.utcnow(),
             'updated_at': datetime.utcnow()
         }
-        
+        mongo.db.comment_replies.insert_one(reply)
+
+        def push_cached_reply():
+            # Only migrated comments: on a legacy one the slice would drop embedded replies
+            return mongo.db.comments.update_one(
+                {'_id': ObjectId(comment_id), 'reply_count': {'$exists': True}},
+                {
+                    '$push': {'replies': {'$each': [Comment.cached_reply(reply)],
+                                          '$slice': -Comment.latest_replies}},
+                    '$inc': {'reply_count': 1}
+                }
+            )
+
+        result = push_cached_reply()
+        if result.matched_count == 0 and Comment.ensure_migrated(comment_id):
+            result = push_cached_reply()
+        if result.matched_count == 0:
+            mongo.db.comment_replies.delete_one({'_id': reply['_id']})
+        return result
+
+    @staticmethod
+    def refresh_latest_replies(comment_id, count_delta=0):
+        """Rebuild a comment's cached replies from comment_replies"""
+        latest = mongo.db.comment_replies.find(
+            {'comment_id': ObjectId(comment_id)}
+        ).sort([('created_at', -1), ('_id', -1)]).limit(Comment.latest_replies)
         return mongo.db.comments.update_one(
             {'_id': ObjectId(comment_id)},
-            {'$push': {'replies': reply}}
+            {
+                '$set': {'replies': [Comment.cached_reply(reply) for reply in reversed(list(latest))]},
+                '$inc': {'reply_count': count_delta}
+            }
         )
 
     @staticmethod
-    def get_comments_by_project(project_id):
-        comments = list(mongo.db.comments.find(
-            {'project_id': ObjectId(project_id)}
-        ).sort('created_at', -1))
+    def serialize(comment):
+        """Convert ObjectIds of a comment and its replies to strings"""
+        for field in ('_id', 'project_id', 'user_id'):
+            if field in comment:
+                comment[field] = str(comment[field])
+        for reply in comment.get('replies', []):
+            Comment.serialize_reply(reply)
+        return comment
+
+    @staticmethod
+    def serialize_reply(reply):
+        """Shape a reply like the ones embedded in comments: string id, no comment_id"""
+        if '_id' in reply:
+            reply['id'] = str(reply.pop('_id'))
+        reply.pop('comment_id', None)
+        if 'user_id' in reply:
+            reply['user_id'] = str(reply['user_id'])
+        return reply
 
-        # Convert ObjectIds to strings for each comment and its replies
+    @staticmethod
+    def get_comments_by_project(project_id, limit=None, cursor=None, projection=None,
+                                latest_replies=None):
+        """
+        A page of top-level comments, newest first, keyed on (created_at, _id).
+        Comments carry their reply_count and their latest_replies most recent
+        replies, or every reply when latest_replies is None. Replies beyond the
+        cached ones are loaded from comment_replies.
+        """
+        projection = dict(projection or {field: 1 for field in Comment.schema.fields})
+        requested = set(projection)
+        # Telling legacy comments apart and counting their replies needs both
+        if requested & {'replies', 'reply_count'}:
+            projection.update({'replies': 1, 'reply_count': 1})
+        comments, next_cursor = paginate(
+            mongo.db.comments, {'project_id': ObjectId(project_id)},
+            'created_at', -1, limit, cursor, projection
+        )
+        if 'replies' in projection:
+            Comment.load_replies(comments, latest_replies)
+            for comment in comments:
+                for field in ('replies', 'reply_count'):
+                    if field not in requested:
+                        comment.pop(field, None)
+        return [Comment.serialize(comment) for comment in comments], next_cursor
+
+    @staticmethod
+    def load_replies(comments, latest_replies):
+        """Set the replies of a page of comments to their latest_replies most recent"""
+        # Comments not migrated yet still embed all of their replies
+        missing = []
         for comment in comments:
-            comment['_id'] = str(comment['_id'])
-            comment['project_id'] = str(comment['project_id'])
-            comment['user_id'] = str(comment['user_id'])
-            for reply in comment.get('replies', []):
-                reply['user_id'] = str(reply['user_id'])
-        
-        return comments
+            replies = comment.get('replies', [])
+            if 'reply_count' not in comment:
+                comment['reply_count'] = len(replies)
+            elif len(replies) < min(comment['reply_count'], latest_replies or comment['reply_count']):
+                missing.append(comment)
+            if latest_replies:
+                comment['replies'] = replies[-latest_replies:]
+
+        if latest_replies is None and missing:
+            # Every reply of the page in one query
+            replies = {comment['_id']: [] for comment in missing}
+            for reply in mongo.db.comment_replies.find(
+                {'comment_id': {'$in': list(replies)}}
+            ).sort([('comment_id', 1), ('created_at', 1), ('_id', 1)]):
+                replies[reply['comment_id']].append(reply)
+            for comment in missing:
+                comment['replies'] = replies[comment['_id']]
+        else:
+            for comment in missing:
+                latest = mongo.db.comment_replies.find(
+                    {'comment_id': comment['_id']}
+                ).sort([('created_at', -1), ('_id', -1)]).limit(latest_replies)
+                comment['replies'] = list(reversed(list(latest)))
+
+    @staticmethod
+    def get_replies(comment_id, limit=None, cursor=None):
+        """A page of a comment's replies, oldest first, keyed on (created_at, _id)"""
+        Comment.ensure_migrated(comment_id)
+        replies, next_cursor = paginate(
+            mongo.db.comment_replies, {'comment_id': ObjectId(comment_id)},
+            'created_at', 1, limit, cursor
+        )
+        return [Comment.serialize_reply(reply) for reply in replies], next_cursor
+
+    @staticmethod
+    def get_reply(comment_id, reply_id):
+        if not ObjectId.is_valid(reply_id):
+            return None
+        Comment.ensure_migrated(comment_id)
+        return mongo.db.comment_replies.find_one(
+            {'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)}
+        )
 
     @staticmethod
     def delete_comment(comment_id):
-        return mongo.db.comments.delete_one({'_id': ObjectId(comment_id)})
+        result = mongo.db.comments.delete_one({'_id': ObjectId(comment_id)})
+        if result.deleted_count:
+            mongo.db.comment_replies.delete_many({'comment_id': ObjectId(comment_id)})
+        return result
 
     @staticmethod
     def update_comment(comment_id, user_id, text):
@@ -96,30 +245,84 @@ class Comment:
 
     @staticmethod
     def delete_reply(comment_id, reply_id, user_id):
-        return mongo.db.comments.update_one(
-            {'_id': ObjectId(comment_id)},
-            {'$pull': {'replies': {'id': reply_id}}}
+        result = mongo.db.comment_replies.delete_one(
+            {'_id': ObjectId(reply_id), 'comment_id': ObjectId(comment_id)}
         )
+        if result.deleted_count:
+            Comment.refresh_latest_replies(comment_id, -1)
+        return result
 
     @staticmethod
     def update_reply(comment_id, reply_id, user_id, text):
-        return mongo.db.comments.update_one(
+        now = datetime.utcnow()
+        result = mongo.db.comment_replies.update_one(
             {
-                '_id': ObjectId(comment_id),
-                'replies': {
-                    '$elemMatch': {
-                        'id': reply_id,
-                        'user_id': ObjectId(user_id)
-                    }
-                }
+                '_id': ObjectId(reply_id),
+                'comment_id': ObjectId(comment_id),
+                'user_id': ObjectId(user_id)
             },
-            {
-                '$set': {
-                    'replies.$.text': text,
-                    'replies.$.updated_at': datetime.utcnow()
-                }
-            }
+            {'$set': {'text': text, 'updated_at': now}}
+        )
+        if result.modified_count:
+            # Only matches when the reply is one of the cached latest replies
+            mongo.db.comments.update_one(
+                {'_id': ObjectId(comment_id), 'replies.id': reply_id},
+                {'$set': {'replies.$.text': text, 'replies.$.updated_at': now}}
+            )
+        return result
+
+    @staticmethod
+    def migrate_comment(comment, batch_size=500):
+        """
+        Copy the replies embedded in a comment written before comment_replies
+        existed into that collection, keeping their ids, then trim the comment
+        to its cached replies. Safe to repeat or to run concurrently.
+        """
+        replies = comment.get('replies', [])
+        batch = []
+        for reply in replies:
+            reply_id = ObjectId(reply['id']) if ObjectId.is_valid(reply.get('id')) else ObjectId()
+            document = {key: value for key, value in reply.items() if key != 'id'}
+            document.update(_id=reply_id, comment_id=comment['_id'])
+            batch.append(UpdateOne({'_id': reply_id}, {'$setOnInsert': document}, upsert=True))
+            if len(batch) >= batch_size:
+                mongo.db.comment_replies.bulk_write(batch, ordered=False)
+                batch = []
+        if batch:
+            mongo.db.comment_replies.bulk_write(batch, ordered=False)
+
+        return mongo.db.comments.update_one(
+            {'_id': comment['_id'], 'reply_count': {'$exists': False}},
+            {'$set': {'replies': replies[-Comment.latest_replies:], 'reply_count': len(replies)}}
+        )
+
+    @staticmethod
+    def ensure_migrated(comment_id):
+        """Migrate a legacy comment the first time it is touched; True if it needed it"""
+        comment = mongo.db.comments.find_one(
+            {'_id': ObjectId(comment_id), 'reply_count': {'$exists': False}}, {'replies': 1}
+        )
+        if not comment:
+            return False
+        Comment.migrate_comment(comment)
+        return True
+
+    @staticmethod
+    def migrate_embedded_replies(batch_size=500):
+        """Migrate every legacy comment, then record that the migration finished"""
+        migrated = 0
+        for comment in mongo.db.comments.find({'reply_count': {'$exists': False}}, {'replies': 1}):
+            migrated += Comment.migrate_comment(comment, batch_size).modified_count
+        mongo.db.counters.update_one(
+            {'_id': 'comment_replies'}, {'$set': {'migrated_at': datetime.utcnow()}}, upsert=True
         )
+        return migrated
+
+    @staticmethod
+    def schedule_reply_migration():
+        """Queue the migration at startup until one has completed"""
+        if not mongo.db.counters.find_one({'_id': 'comment_replies'}, {'_id': 1}):
+            enqueue('comment_replies_migration', {})
 
     @staticmethod
     def get_comment(comment_id):
@@ -132,3 +335,23 @@ class Comment:
             {"email": email},
             {"password": 0, "reset_token": 0, "reset_token_expires": 0}
         )
+
+@task('comment_replies_migration')
+def migrate_comment_replies(payload):
+    Comment.migrate_embedded_replies()
+
+@task('comment_created')
+def notify_project_team(payload):
+    """Tell the project team about a new comment, except its author"""
+    project = Project.get_project_by_id(payload['project_id'], {'title': 1, 'team_members.user_id': 1})
+    if not project:
+        return
+    Notification.fan_out(
+        [member['user_id'] for member in project.get('team_members', [])
+         if member['user_id'] != payload['user_id']],
+        'project_comment',
+        f"New comment on project '{project['title']}'",
+        # Keyed on the project so a busy thread coalesces into one entry per member
+        payload['project_id'],
+        {'user_id': payload['user_id'], 'name': payload.get('user_name')}
+    )
@@ -1,10 +1,11 @@
 from flask import Blueprint, request, jsonify
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from auth.jwt_utils import get_current_user, get_current_author
 from comments.models import Comment
-from users.models import UserService
 from marshmallow import ValidationError
-from projects.models import Project
 from notifications.models import Notification
+from shared.projection import parse_fields
+from shared.pagination import DEFAULT_PAGE_SIZE, parse_limit
 
 comments = Blueprint("comments", __name__)
 
@@ -12,8 +13,18 @@ comments = Blueprint("comments", __name__)
 @jwt_required()
 def get_project_comments(project_id):
     try:
-        comments = Comment.get_comments_by_project(project_id)
-        return jsonify({"comments": comments or []}), 200
+        try:
+            projection = parse_fields(request.args.get('fields'), Comment.schema.fields)
+            limit = parse_limit(request.args.get('limit'))
+            # Paged requests get the latest few replies per comment unless ?replies= says otherwise
+            latest_replies = parse_limit(request.args.get('replies'),
+                                         Comment.latest_replies if limit else None)
+            comments, next_cursor = Comment.get_comments_by_project(
+                project_id, limit, request.args.get('cursor'), projection, latest_replies
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"comments": comments or [], "next_cursor": next_cursor}), 200
         
     except Exception as e:
         print(f"Error fetching comments: {str(e)}")
@@ -24,73 +35,34 @@ def get_project_comments(project_id):
 def create_comment(project_id):
     try:
         data = request.get_json()
-        current_user_email = get_jwt_identity()
         
         # Get user data for the comment
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_author()
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Create the comment
-        try:
-            comment_id = Comment.create_comment(
-                project_id=project_id,
-                user_id=str(user['_id']),
-                text=data.get('text'),
-                user_data=user
-            )
-        except Exception as e:
-            print(f"Error creating comment: {str(e)}")
-            return jsonify({"error": f"Failed to create comment: {str(e)}"}), 500
-
-        # Get the newly created comment
-        try:
-            new_comment = Comment.get_comment(comment_id)
-            if new_comment:
-                # Convert ObjectIds to strings
-                new_comment['_id'] = str(new_comment['_id'])
-                new_comment['project_id'] = str(new_comment['project_id'])
-                new_comment['user_id'] = str(new_comment['user_id'])
-            else:
-                return jsonify({"error": "Comment created but not retrieved"}), 500
-        except Exception as e:
-            print(f"Error retrieving new comment: {str(e)}")
-            return jsonify({"error": f"Failed to retrieve new comment: {str(e)}"}), 500
-
-        # Handle notifications
-        try:
-            project = Project.get_project_by_id(project_id)
-            if project:
-                for member_id in project['team_members']:
-                    if member_id['user_id'] != str(user['_id']):  # Don't notify the comment author
-                        Notification.create_notification(
-                            member_id['user_id'],
-                            'project_comment',
-                            f"New comment on project '{project['title']}'",
-                            comment_id
-                        )
-        except Exception as e:
-            print(f"Error creating notifications: {str(e)}")
-            # Don't return error here, as the comment was already created
+        new_comment = Comment.create_comment(
+            project_id=project_id,
+            user_id=str(user['_id']),
+            text=data.get('text'),
+            user_data=user
+        )
 
         return jsonify({
             "message": "Comment created successfully",
-            "comment": new_comment
+            "comment": Comment.serialize(new_comment)
         }), 201
         
     except ValidationError as err:
-        print(f"Validation error: {err.messages}")
         return jsonify({"errors": err.messages}), 400
     except Exception as e:
-        print(f"Unexpected error in create_comment: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
 @comments.route("/comments/<comment_id>", methods=["DELETE"])
 @jwt_required()
 def delete_comment(comment_id):
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -118,8 +90,7 @@ def delete_comment(comment_id):
 def update_comment(comment_id):
     try:
         data = request.get_json()
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -147,9 +118,7 @@ def update_comment(comment_id):
 def add_reply(comment_id):
     try:
         data = request.get_json()
-        current_user_email = get_jwt_identity()
-        
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_author()
         if not user:
             return jsonify({"error": "User not found"}), 404
 
@@ -170,7 +139,8 @@ def add_reply(comment_id):
                 str(comment['user_id']),
                 'comment_reply',
                 f"New reply to your comment",
-                comment_id
+                comment_id,
+                {'user_id': str(user['_id']), 'name': user.get('name')}
             )
 
         return jsonify({"message": "Reply added successfully"}), 201
@@ -178,23 +148,30 @@ def add_reply(comment_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@comments.route("/comments/<comment_id>/replies", methods=["GET"])
+@jwt_required()
+def get_replies(comment_id):
+    try:
+        try:
+            limit = parse_limit(request.args.get('limit'), DEFAULT_PAGE_SIZE)
+            replies, next_cursor = Comment.get_replies(comment_id, limit, request.args.get('cursor'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"replies": replies, "next_cursor": next_cursor}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @comments.route("/comments/<comment_id>/replies/<reply_id>", methods=["DELETE"])
 @jwt_required()
 def delete_reply(comment_id, reply_id):
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Get the comment first
-        comment = Comment.get_comment(comment_id)
-        if not comment:
-            return jsonify({"error": "Comment not found"}), 404
-
-        # Find the specific reply
-        reply = next((r for r in comment.get('replies', []) if r['id'] == reply_id), None)
+        reply = Comment.get_reply(comment_id, reply_id)
         if not reply:
             return jsonify({"error": "Reply not found"}), 404
 
@@ -216,19 +193,12 @@ def delete_reply(comment_id, reply_id):
 def update_reply(comment_id, reply_id):
     try:
         data = request.get_json()
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        # Get the comment first
-        comment = Comment.get_comment(comment_id)
-        if not comment:
-            return jsonify({"error": "Comment not found"}), 404
-
-        # Find the specific reply
-        reply = next((r for r in comment.get('replies', []) if r['id'] == reply_id), None)
+        reply = Comment.get_reply(comment_id, reply_id)
         if not reply:
             return jsonify({"error": "Reply not found"}), 404
 
@@ -25,8 +25,8 @@ class KnowledgeBase:
         return str(result.inserted_id)
     
     @staticmethod
-    def get_project_items(project_id):
-        return list(mongo.db.knowledge_base.find({'project_id': project_id}))
+    def get_project_items(project_id, projection=None):
+        return list(mongo.db.knowledge_base.find({'project_id': project_id}, projection))
     
     @staticmethod
     def get_item(item_id):
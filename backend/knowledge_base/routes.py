@@ -1,12 +1,13 @@
 from flask import Blueprint, request, jsonify, send_from_directory
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from auth.jwt_utils import get_current_user, get_current_author
 from knowledge_base.models import KnowledgeBase
-from users.models import UserService
 from marshmallow import ValidationError
 import os
 from werkzeug.utils import secure_filename
 from bson import ObjectId
 from datetime import datetime
+from shared.projection import parse_fields
 
 knowledge_base = Blueprint("knowledge_base", __name__)
 
@@ -23,8 +24,7 @@ def allowed_file(filename):
 @jwt_required()
 def create_knowledge_base_item(project_id):
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_author()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -90,7 +90,11 @@ def create_knowledge_base_item(project_id):
 @jwt_required()
 def get_knowledge_base_items(project_id):
     try:
-        items = KnowledgeBase.get_project_items(project_id)
+        try:
+            projection = parse_fields(request.args.get('fields'), KnowledgeBase.schema.fields)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        items = KnowledgeBase.get_project_items(project_id, projection)
         
         # Convert ObjectId to string for JSON serialization
         for item in items:
@@ -105,8 +109,7 @@ def get_knowledge_base_items(project_id):
 @jwt_required()
 def update_knowledge_base_item(item_id):
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
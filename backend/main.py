@@ -2,17 +2,27 @@ from flask import Flask, jsonify
 from flask_jwt_extended import JWTManager
 from flask_cors import CORS
 from shared.database import init_db
-from shared.config import MONGO_URI, JWT_SECRET_KEY, JWT_ACCESS_TOKEN_EXPIRES
+from shared.config import MONGO_URI, JWT_SECRET_KEY, JWT_ACCESS_TOKEN_EXPIRES, ENSURE_INDEXES_ON_STARTUP
+from shared.indexes import ensure_indexes, index_drift
 from auth.routes import auth
 from projects.routes import projects
 from users.routes import users
 from comments.routes import comments
 from notifications.routes import notifications
 from knowledge_base.routes import knowledge_base
+from projects.models import Project
+from users.models import UserService, user_cache
+from auth.jwt_utils import is_token_revoked
+from auth.bcrypt_utils import hashing_metrics
+from auth.models import User
+from comments.models import Comment
+from notifications.models import Notification
+from shared import tasks
+from notifications.push import init_push
 
 app = Flask(__name__)
 # Simple CORS configuration
-CORS(app, resources={r"/*": {"origins": "*"}})
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["ETag", "X-Next-Cursor"])
 
 # Configurations
 app.config["MONGO_URI"] = MONGO_URI
@@ -21,7 +31,14 @@ app.config["JWT_ACCESS_TOKEN_EXPIRES"] = JWT_ACCESS_TOKEN_EXPIRES
 
 # Initialize database and JWT
 init_db(app)
+if ENSURE_INDEXES_ON_STARTUP:
+    ensure_indexes()
+tasks.start_worker()
+Comment.schedule_reply_migration()
+UserService.schedule_search_backfill()
+Notification.schedule_backfill()
 jwt = JWTManager(app)
+jwt.token_in_blocklist_loader(is_token_revoked)
 
 # Register blueprints
 app.register_blueprint(auth)
@@ -30,6 +47,68 @@ app.register_blueprint(users)
 app.register_blueprint(comments)
 app.register_blueprint(notifications)
 app.register_blueprint(knowledge_base)
+init_push(app)
+
+@app.cli.command("create-indexes")
+def create_indexes():
+    """Apply every index declared in shared/indexes.py"""
+    for collection, names in ensure_indexes().items():
+        print(f"{collection}: {', '.join(names)}")
+
+@app.cli.command("index-drift")
+def check_index_drift():
+    """Report differences between declared and live indexes"""
+    drift = index_drift()
+    if not drift:
+        print("Indexes match the registry")
+        return
+    for collection, report in drift.items():
+        for kind, names in report.items():
+            if names:
+                print(f"{collection} {kind}: {', '.join(names)}")
+    raise SystemExit(1)
+
+@app.cli.command("rebuild-project-stats")
+def rebuild_project_stats():
+    """Recompute the project_stats rollup (k8/project-stats-cronjob.yaml runs it daily)"""
+    Project.rebuild_stats()
+
+@app.cli.command("backfill-user-search-fields")
+def backfill_user_search_fields():
+    """Populate normalized search fields on existing users"""
+    print(f"Updated {UserService.backfill_search_fields()} users")
+
+@app.cli.command("remove-legacy-reset-tokens")
+def remove_legacy_reset_tokens():
+    """Unset plaintext reset tokens left on user documents"""
+    print(f"Cleaned {User.remove_legacy_reset_tokens().modified_count} users")
+
+@app.cli.command("migrate-comment-replies")
+def migrate_comment_replies():
+    """Move replies embedded in comments into the comment_replies collection"""
+    print(f"Migrated {Comment.migrate_embedded_replies()} comments")
+
+@app.cli.command("rebuild-unread-counts")
+def rebuild_unread_counts():
+    """Recompute per-user unread notification counters"""
+    print(f"Rebuilt counters for {Notification.rebuild_unread_counts()} users")
+
+@app.cli.command("backfill-notification-fields")
+def backfill_notification_fields():
+    """Add count and updated_at to notifications stored before coalescing"""
+    print(f"Updated {Notification.backfill_coalescing_fields()} notifications")
+
+@app.cli.command("apply-notification-retention")
+def apply_notification_retention():
+    """Expire read notifications and roll up old unread ones (k8/notification-retention-cronjob.yaml runs it daily)"""
+    print(f"Applied read watermarks to {Notification.apply_read_watermarks()} notifications")
+    print(f"Scheduled expiry for {Notification.expire_read_notifications()} read notifications")
+    print(f"Rolled up {Notification.roll_up_unread()} unread notifications")
+
+@app.cli.command("run-tasks")
+def run_tasks():
+    """Drain the task outbox (use with TASK_MODE=external)"""
+    tasks.run_forever()
 
 @app.route("/")
 def home():
@@ -37,7 +116,11 @@ def home():
 
 @app.route('/health')
 def health_check():
-    return jsonify({"status": "healthy"}), 200
+    return jsonify({
+        "status": "healthy",
+        "user_cache": user_cache.stats(),
+        "password_hashing": hashing_metrics()
+    }), 200
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000)
\ No newline at end of file
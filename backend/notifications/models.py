@@ -1,73 +1,460 @@
-from datetime import datetime
+from datetime import datetime, timedelta
 from bson import ObjectId
+from collections import Counter
+from werkzeug.http import http_date
+from pymongo import DeleteOne, ReturnDocument, UpdateOne
 from shared.database import mongo
+from shared.pagination import paginate
+from shared.tasks import task, enqueue
+from shared.config import NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS
+from notifications import push
 from marshmallow import Schema, fields, validate
 
 class NotificationSchema(Schema):
     _id = fields.Str(dump_only=True)
     user_id = fields.Str(required=True)
     type = fields.Str(required=True, validate=validate.OneOf([
-        'project_added', 'project_comment', 'comment_reply', 'new_project'
+        'new_project', 'added_to_project', 'removed_from_project', 'project_acceptance',
+        'project_rejection', 'project_comment', 'comment_reply'
     ]))
     content = fields.Str(required=True)
     reference_id = fields.Str(required=True)  # Project ID or Comment ID
     is_read = fields.Bool(default=False)
+    count = fields.Int(dump_only=True)  # Occurrences coalesced into this entry
+    actor = fields.Dict(dump_only=True)  # Latest user who caused it: {user_id, name}
     created_at = fields.DateTime(dump_only=True)
+    updated_at = fields.DateTime(dump_only=True)
 
 class Notification:
     schema = NotificationSchema()
 
+    # Days a notification of each type is kept: (once read, while unread).
+    # Reading a notification sets expires_at and the TTL index removes it;
+    # unread ones past their limit are rolled up into notification_summaries.
+    retention = {
+        'added_to_project': (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS),
+        'removed_from_project': (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS),
+        'project_acceptance': (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS),
+        'project_rejection': (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS),
+        'project_comment': (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS),
+        'comment_reply': (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS),
+        # Announced to everyone, so they go stale fastest
+        'new_project': (min(7, NOTIFICATION_READ_RETENTION_DAYS), min(30, NOTIFICATION_UNREAD_RETENTION_DAYS)),
+    }
+    default_retention = (NOTIFICATION_READ_RETENTION_DAYS, NOTIFICATION_UNREAD_RETENTION_DAYS)
+
+    @staticmethod
+    def read_expiry(now):
+        """Aggregation expression for expires_at of a notification read at now"""
+        def expiry(days):
+            return now + timedelta(days=days)
+        return {'$switch': {
+            'branches': [{'case': {'$eq': ['$type', type]}, 'then': expiry(read_days)}
+                         for type, (read_days, _) in Notification.retention.items()],
+            'default': expiry(Notification.default_retention[0])
+        }}
+
+    # Unread totals live in notification_counters ({_id: user_id, unread,
+    # read_until}), adjusted by every write that creates, reads or deletes an
+    # unread notification, so the badge is a single point read.
+    #
+    # read_until is the user's read watermark: mark-all-as-read only moves it,
+    # and a notification counts as read when its is_read flag is set or it
+    # was last updated at or before the watermark. apply_read_watermarks()
+    # later copies the watermark onto the documents so retention applies.
+
+    @staticmethod
+    def read_watermarks(user_ids):
+        """{user_id: read_until} for users that have marked everything as read"""
+        return {str(counter['_id']): counter['read_until'] for counter in mongo.db.notification_counters.find(
+            {'_id': {'$in': [ObjectId(user_id) for user_id in user_ids]}, 'read_until': {'$exists': True}},
+            {'read_until': 1}
+        )}
+
+    @staticmethod
+    def unread_filter(user_id, watermark=None):
+        """Query for a user's notifications that are still unread"""
+        query = {'user_id': ObjectId(user_id), 'is_read': False}
+        if watermark:
+            query['updated_at'] = {'$gt': watermark}
+        return query
+
+    @staticmethod
+    def is_read(notification, watermark=None):
+        return bool(notification.get('is_read')) or bool(
+            watermark and notification.get('updated_at', notification['created_at']) <= watermark
+        )
+
+    @staticmethod
+    def push_live(notifications):
+        """
+        Send new notifications to connected clients. Delivery is best effort:
+        the notifications are stored either way and clients catch up on reconnect.
+        """
+        try:
+            push.publish([{
+                **{key: value for key, value in notification.items() if key != 'last_delivery'},
+                '_id': str(notification['_id']),
+                'user_id': str(notification['user_id']),
+                # Same date format as the JSON the REST endpoints return
+                'created_at': http_date(notification['created_at']),
+                'updated_at': http_date(notification['updated_at'])
+            } for notification in notifications])
+        except Exception as e:
+            print(f"Error pushing notifications: {str(e)}")
+
+    @staticmethod
+    def adjust_unread(deltas):
+        """
+        Apply {user_id: delta} to the unread counters in one bulk write.
+        Missing counters are left alone; get_unread_count recounts them.
+        """
+        updates = [UpdateOne({'_id': ObjectId(user_id), 'unread': {'$exists': True}},
+                             {'$inc': {'unread': delta}})
+                   for user_id, delta in deltas.items() if delta]
+        if updates:
+            mongo.db.notification_counters.bulk_write(updates, ordered=False)
+
+    @staticmethod
+    def get_unread_count(user_id):
+        counter = mongo.db.notification_counters.find_one({'_id': ObjectId(user_id)}, {'unread': 1})
+        # No counter yet (e.g. notifications from before counters existed) or drifted below zero
+        if not counter or counter.get('unread', -1) < 0:
+            return Notification.recount_unread(user_id)
+        return counter['unread']
+
+    @staticmethod
+    def recount_unread(user_id):
+        """Reset a user's counter from the notifications themselves"""
+        watermark = Notification.read_watermarks([user_id]).get(str(user_id))
+        unread = mongo.db.notifications.count_documents(Notification.unread_filter(user_id, watermark))
+        mongo.db.notification_counters.update_one(
+            {'_id': ObjectId(user_id)}, {'$set': {'unread': unread}}, upsert=True
+        )
+        return unread
+
+    @staticmethod
+    def rebuild_unread_counts():
+        """Recompute every unread counter; repairs drift after an interrupted write"""
+        Notification.apply_read_watermarks()
+        counts = {row['_id']: row['unread'] for row in mongo.db.notifications.aggregate([
+            {'$match': {'is_read': False}},
+            {'$group': {'_id': '$user_id', 'unread': {'$sum': 1}}}
+        ])}
+        mongo.db.notification_counters.update_many({'_id': {'$nin': list(counts)}}, {'$set': {'unread': 0}})
+        updates = [UpdateOne({'_id': user_id}, {'$set': {'unread': unread}}, upsert=True)
+                   for user_id, unread in counts.items()]
+        if updates:
+            mongo.db.notification_counters.bulk_write(updates, ordered=False)
+        return len(counts)
+
+    @staticmethod
+    def coalesce_key(user_id, type, reference_id, watermark=None):
+        """Unread notifications sharing this key are folded into one entry"""
+        return {**Notification.unread_filter(user_id, watermark), 'type': type, 'reference_id': reference_id}
+
+    @staticmethod
+    def coalesce_update(content, actor, delivery_id, now):
+        """
+        Pipeline update adding one occurrence to an unread entry, or creating
+        it from the coalesce_key fields on upsert. An update carrying the
+        delivery_id it already applied leaves the count alone, so retries
+        don't count twice.
+        """
+        new_entry = {'$eq': [{'$type': '$created_at'}, 'missing']}
+        return [{'$set': {
+            'content': {'$literal': content},
+            'actor': {'$literal': actor},
+            'count': {'$cond': [
+                {'$eq': ['$last_delivery', delivery_id]},
+                '$count',
+                {'$add': [{'$ifNull': ['$count', {'$cond': [new_entry, 0, 1]}]}, 1]}
+            ]},
+            'last_delivery': delivery_id,
+            'created_at': {'$ifNull': ['$created_at', now]},
+            'updated_at': now
+        }}]
+
+    @staticmethod
+    def create_notification(user_id, type, content, reference_id, actor=None):
+        """
+        Notify a user, coalescing with an unread notification of the same
+        type and reference. actor is {'user_id', 'name'} of whoever caused it.
+        """
+        watermark = Notification.read_watermarks([user_id]).get(str(user_id))
+        notification = mongo.db.notifications.find_one_and_update(
+            Notification.coalesce_key(user_id, type, reference_id, watermark),
+            Notification.coalesce_update(content, actor, ObjectId(), datetime.utcnow()),
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if notification['count'] == 1:
+            Notification.adjust_unread({user_id: 1})
+        Notification.push_live([notification])
+        return str(notification['_id'])
+
+    @staticmethod
+    def create_many(user_ids, type, content, reference_id, delivery_id=None, actor=None):
+        """
+        Notify several users with one bulk write of coalescing upserts.
+        Passing delivery_id makes the write safe to retry.
+        Returns how many new entries were created.
+        """
+        if not user_ids:
+            return 0
+        delivery_id = delivery_id or ObjectId()
+        update = Notification.coalesce_update(content, actor, delivery_id, datetime.utcnow())
+        watermarks = Notification.read_watermarks(user_ids)
+        result = mongo.db.notifications.bulk_write([
+            UpdateOne(Notification.coalesce_key(user_id, type, reference_id, watermarks.get(str(user_id))),
+                      update, upsert=True)
+            for user_id in user_ids
+        ], ordered=False)
+        # Only entries this attempt created are new unread notifications
+        Notification.adjust_unread(Counter(user_ids[index] for index in result.upserted_ids))
+        Notification.push_live(list(mongo.db.notifications.find({
+            'user_id': {'$in': [ObjectId(user_id) for user_id in user_ids]},
+            'type': type,
+            'reference_id': reference_id,
+            'last_delivery': delivery_id
+        })))
+        return len(result.upserted_ids)
+
     @staticmethod
-    def create_notification(user_id, type, content, reference_id):
-        notification = {
-            'user_id': ObjectId(user_id),
+    def fan_out(user_ids, type, content, reference_id, actor=None):
+        """
+        Notify several users without blocking the request: the fan-out is
+        queued in the task outbox and written by the worker in one batch.
+        """
+        user_ids = list(dict.fromkeys(user_ids))
+        if not user_ids:
+            return None
+        return enqueue('notification_fan_out', {
+            'user_ids': user_ids,
             'type': type,
             'content': content,
             'reference_id': reference_id,
-            'is_read': False,
-            'created_at': datetime.utcnow()
-        }
-        result = mongo.db.notifications.insert_one(notification)
-        return str(result.inserted_id)
+            'actor': actor,
+            'delivery_id': ObjectId()
+        })
 
     @staticmethod
-    def get_user_notifications(user_id):
-        notifications = list(mongo.db.notifications.find(
-            {'user_id': ObjectId(user_id)}
-        ).sort('created_at', -1))
+    def get_user_notifications(user_id, limit=None, cursor=None):
+        """A page of a user's notifications, most recently updated first, keyed on (updated_at, _id)"""
+        notifications, next_cursor = paginate(
+            mongo.db.notifications, {'user_id': ObjectId(user_id)},
+            'updated_at', -1, limit, cursor, {'last_delivery': 0}
+        )
+        watermark = Notification.read_watermarks([user_id]).get(str(user_id))
         
         # Convert ObjectIds to strings
         for notification in notifications:
+            notification['is_read'] = Notification.is_read(notification, watermark)
             notification['_id'] = str(notification['_id'])
             notification['user_id'] = str(notification['user_id'])
         
-        return notifications
+        return notifications, next_cursor
 
     @staticmethod
     def mark_as_read(notification_id, user_id):
-        return mongo.db.notifications.update_one(
-            {
-                '_id': ObjectId(notification_id),
-                'user_id': ObjectId(user_id)
-            },
-            {'$set': {'is_read': True}}
+        return Notification.mark_many_as_read([notification_id], user_id)
+
+    @staticmethod
+    def mark_many_as_read(notification_ids, user_id):
+        """
+        Set the read flag on several of a user's notifications in one update.
+        Ones already below the read watermark are left for apply_read_watermarks.
+        """
+        watermark = Notification.read_watermarks([user_id]).get(str(user_id))
+        result = mongo.db.notifications.update_many(
+            {**Notification.unread_filter(user_id, watermark),
+             '_id': {'$in': [ObjectId(notification_id) for notification_id in notification_ids]}},
+            [{'$set': {'is_read': True, 'expires_at': Notification.read_expiry(datetime.utcnow())}}]
         )
+        Notification.adjust_unread({user_id: -result.modified_count})
+        return result
 
     @staticmethod
     def mark_all_as_read(user_id):
-        return mongo.db.notifications.update_many(
-            {'user_id': ObjectId(user_id)},
-            {'$set': {'is_read': True}}
+        """Move the read watermark to now; returns how many notifications were unread"""
+        now = datetime.utcnow()
+        counter = mongo.db.notification_counters.find_one_and_update(
+            {'_id': ObjectId(user_id)},
+            {'$set': {'read_until': now, 'unread': 0}},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
         )
+        if counter and counter.get('unread', -1) >= 0:
+            return counter['unread']
+        # No trustworthy counter, so count what the watermark just covered
+        query = Notification.unread_filter(user_id, counter and counter.get('read_until'))
+        query['updated_at'] = {**query.get('updated_at', {}), '$lte': now}
+        return mongo.db.notifications.count_documents(query)
 
     @staticmethod
     def delete_notification(notification_id, user_id):
-        return mongo.db.notifications.delete_one({
-            '_id': ObjectId(notification_id),
-            'user_id': ObjectId(user_id)
-        })
+        """Delete a notification; returns it, or None if the user has no such notification"""
+        deleted = Notification.delete_many([notification_id], user_id)
+        return deleted[0] if deleted else None
+
+    @staticmethod
+    def delete_many(notification_ids, user_id):
+        """Delete several of a user's notifications; returns the ones that existed"""
+        notifications = list(mongo.db.notifications.find(
+            {'_id': {'$in': [ObjectId(notification_id) for notification_id in notification_ids]},
+             'user_id': ObjectId(user_id)},
+            {'is_read': 1, 'created_at': 1, 'updated_at': 1}
+        ))
+        if not notifications:
+            return []
+        mongo.db.notifications.delete_many({'_id': {'$in': [n['_id'] for n in notifications]}})
+        watermark = Notification.read_watermarks([user_id]).get(str(user_id))
+        Notification.adjust_unread({user_id: -sum(
+            1 for notification in notifications if not Notification.is_read(notification, watermark)
+        )})
+        return notifications
 
     @staticmethod
     def clear_all_notifications(user_id):
         """Delete all notifications for a specific user."""
-        return mongo.db.notifications.delete_many({"user_id": ObjectId(user_id)})
\ No newline at end of file
+        result = mongo.db.notifications.delete_many({"user_id": ObjectId(user_id)})
+        mongo.db.notification_summaries.delete_one({"_id": ObjectId(user_id)})
+        # Anything inserted meanwhile survives the delete, so count rather than zero
+        Notification.recount_unread(user_id)
+        return result
+
+    @staticmethod
+    def get_summary(user_id):
+        """Counts of a user's old unread notifications that were rolled up, or None"""
+        return mongo.db.notification_summaries.find_one({'_id': ObjectId(user_id)}, {'_id': 0})
+
+    @staticmethod
+    def apply_read_watermarks():
+        """Flag notifications below each user's read watermark as read so they expire"""
+        applied = 0
+        for counter in mongo.db.notification_counters.find(
+            {'read_until': {'$exists': True}, '$expr': {'$ne': ['$applied_until', '$read_until']}},
+            {'read_until': 1}
+        ):
+            applied += mongo.db.notifications.update_many(
+                {'user_id': counter['_id'], 'is_read': False, 'updated_at': {'$lte': counter['read_until']}},
+                [{'$set': {'is_read': True, 'expires_at': Notification.read_expiry(datetime.utcnow())}}]
+            ).modified_count
+            mongo.db.notification_counters.update_one(
+                {'_id': counter['_id']}, {'$set': {'applied_until': counter['read_until']}}
+            )
+        return applied
+
+    @staticmethod
+    def expire_read_notifications():
+        """Give read notifications stored before the retention policy an expires_at"""
+        return mongo.db.notifications.update_many(
+            {'is_read': True, 'expires_at': {'$exists': False}},
+            [{'$set': {'expires_at': Notification.read_expiry(datetime.utcnow())}}]
+        ).modified_count
+
+    @staticmethod
+    def roll_up_unread(batch_size=500):
+        """
+        Replace unread notifications idle for longer than their type's retention with
+        per-user counts in notification_summaries ({_id: user_id, counts:
+        {type: n}, oldest, newest}). Returns how many were rolled up.
+        """
+        now = datetime.utcnow()
+        expired = {'is_read': False, '$or': [
+            {'type': type, 'updated_at': {'$lt': now - timedelta(days=unread_days)}}
+            for type, (_, unread_days) in Notification.retention.items()
+        ] + [{
+            'type': {'$nin': list(Notification.retention)},
+            'updated_at': {'$lt': now - timedelta(days=Notification.default_retention[1])}
+        }]}
+
+        rolled_up = 0
+        while True:
+            batch = list(mongo.db.notifications.find(
+                expired, {'user_id': 1, 'type': 1, 'count': 1, 'created_at': 1, 'updated_at': 1}
+            ).limit(batch_size))
+            if not batch:
+                break
+
+            # Ones below a newer read watermark were read, not abandoned
+            watermarks = Notification.read_watermarks({str(n['user_id']) for n in batch})
+            read = {n['_id'] for n in batch if Notification.is_read(n, watermarks.get(str(n['user_id'])))}
+            if read:
+                mongo.db.notifications.update_many(
+                    {'_id': {'$in': list(read)}},
+                    [{'$set': {'is_read': True, 'expires_at': Notification.read_expiry(now)}}]
+                )
+                batch = [n for n in batch if n['_id'] not in read]
+            if not batch:
+                continue
+
+            # Delete only entries still unread and untouched since the find;
+            # anything read or coalesced into meanwhile survives and is not counted
+            result = mongo.db.notifications.bulk_write([
+                DeleteOne({'_id': n['_id'], 'is_read': False, 'updated_at': n['updated_at']}) for n in batch
+            ], ordered=False)
+            if result.deleted_count < len(batch):
+                survivors = {n['_id'] for n in mongo.db.notifications.find(
+                    {'_id': {'$in': [n['_id'] for n in batch]}}, {'_id': 1}
+                )}
+                batch = [n for n in batch if n['_id'] not in survivors]
+
+            summaries = {}
+            for notification in batch:
+                summary = summaries.setdefault(notification['user_id'], {
+                    'counts': Counter(),
+                    'entries': 0,
+                    'oldest': notification['created_at'],
+                    'newest': notification['updated_at']
+                })
+                summary['entries'] += 1
+                summary['counts'][notification['type']] += notification.get('count', 1)
+                summary['oldest'] = min(summary['oldest'], notification['created_at'])
+                summary['newest'] = max(summary['newest'], notification['updated_at'])
+            if not summaries:
+                continue
+            mongo.db.notification_summaries.bulk_write([
+                UpdateOne({'_id': user_id}, {
+                    '$inc': {f"counts.{type}": count for type, count in summary['counts'].items()},
+                    '$min': {'oldest': summary['oldest']},
+                    '$max': {'newest': summary['newest']},
+                    '$set': {'updated_at': now}
+                }, upsert=True)
+                for user_id, summary in summaries.items()
+            ], ordered=False)
+
+            Notification.adjust_unread({
+                str(user_id): -summary['entries'] for user_id, summary in summaries.items()
+            })
+            rolled_up += len(batch)
+        return rolled_up
+
+    @staticmethod
+    def backfill_coalescing_fields():
+        """Give notifications stored before coalescing a count and updated_at"""
+        return mongo.db.notifications.update_many(
+            {'updated_at': {'$exists': False}},
+            [{'$set': {'count': {'$ifNull': ['$count', 1]}, 'updated_at': '$created_at'}}]
+        ).modified_count
+
+    @staticmethod
+    def schedule_backfill():
+        """Queue backfill_coalescing_fields at startup while any notification lacks updated_at"""
+        if mongo.db.notifications.find_one({'updated_at': {'$exists': False}}, {'_id': 1}):
+            enqueue('notification_backfill', {})
+
+@task('notification_backfill')
+def backfill_notification_fields(payload):
+    Notification.backfill_coalescing_fields()
+
+@task('notification_fan_out')
+def deliver_fan_out(payload):
+    Notification.create_many(
+        payload['user_ids'],
+        payload['type'],
+        payload['content'],
+        payload['reference_id'],
+        payload.get('delivery_id'),
+        payload.get('actor')
+    )
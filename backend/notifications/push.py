@@ -0,0 +1,69 @@
+import socketio
+from socketio.exceptions import ConnectionRefusedError
+from flask_jwt_extended import decode_token
+from auth.jwt_utils import is_token_revoked
+from shared.broadcast import create_broadcaster
+from shared.config import PUSH_BACKEND, SOCKETIO_IN_APP, SOCKETIO_CORS_ORIGINS
+
+# Real-time delivery of notifications over Socket.IO. Clients connect with
+# their access token (io(url, {auth: {token}})) and join a room named after
+# their user ID. New notifications are published on the broadcaster so the
+# process holding the client's connection emits them, whichever process
+# created the notification.
+#
+# Sockets are served by push_server.py, an eventlet process of its own, so
+# thousands of idle connections never occupy the API's worker threads. The
+# API only publishes. SOCKETIO_IN_APP serves them from the API process
+# instead, for local development with the memory broadcaster.
+
+CHANNEL = 'notifications'
+
+broadcaster = create_broadcaster(PUSH_BACKEND)
+sio = None
+_app = None
+
+def create_socket_app(app, async_mode):
+    """Wrap app with the Socket.IO server and start receiving broadcasts"""
+    global sio, _app
+    _app = app
+    # WebSocket only: without long-polling a client never needs to reach the
+    # same process twice, so several processes work without sticky sessions
+    sio = socketio.Server(
+        async_mode=async_mode,
+        cors_allowed_origins=SOCKETIO_CORS_ORIGINS,
+        transports=['websocket']
+    )
+    sio.on('connect', connect)
+    broadcaster.subscribe(deliver)
+    broadcaster.start()
+    return socketio.WSGIApp(sio, app.wsgi_app)
+
+def init_push(app):
+    """Called by the API; serves sockets itself only when SOCKETIO_IN_APP is set"""
+    if SOCKETIO_IN_APP:
+        app.wsgi_app = create_socket_app(app, 'threading')
+
+def connect(sid, environ, auth):
+    token = (auth or {}).get('token')
+    if not token:
+        raise ConnectionRefusedError('Missing token')
+    try:
+        with _app.app_context():
+            payload = decode_token(token)
+            revoked = is_token_revoked(None, payload)
+    except Exception:
+        raise ConnectionRefusedError('Invalid token')
+    if revoked or 'user_id' not in payload:
+        raise ConnectionRefusedError('Invalid token')
+    sio.enter_room(sid, payload['user_id'])
+
+def publish(notifications):
+    """Push serialized notifications to their recipients; one broadcast per batch"""
+    if notifications:
+        broadcaster.publish(CHANNEL, {'notifications': notifications})
+
+def deliver(channel, message):
+    if channel != CHANNEL:
+        return
+    for notification in message['notifications']:
+        sio.emit('notification', notification, room=notification['user_id'])
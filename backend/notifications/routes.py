@@ -1,32 +1,77 @@
 from flask import Blueprint, jsonify, request
-from flask_jwt_extended import jwt_required, get_jwt_identity
+from flask_jwt_extended import jwt_required
+from auth.jwt_utils import get_current_user
 from notifications.models import Notification
-from users.models import UserService
+from bson import ObjectId
+from shared.pagination import MAX_PAGE_SIZE, parse_limit
 
 notifications = Blueprint("notifications", __name__)
 
+def parse_notification_ids(data):
+    """Validate the {"ids": [...]} body of the batch endpoints"""
+    ids = (data or {}).get('ids')
+    if not isinstance(ids, list) or not ids:
+        raise ValueError("ids must be a non-empty list")
+    if len(ids) > MAX_PAGE_SIZE:
+        raise ValueError(f"At most {MAX_PAGE_SIZE} ids per request")
+    if not all(isinstance(i, str) and ObjectId.is_valid(i) for i in ids):
+        raise ValueError("ids must be notification IDs")
+    return list(dict.fromkeys(ids))
+
 @notifications.route("/notifications", methods=["GET"])
 @jwt_required()
 def get_notifications():
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        notifications = Notification.get_user_notifications(str(user['_id']))
-        return jsonify({"notifications": notifications}), 200
+        try:
+            # Without ?limit= every notification is returned, as before
+            notifications, next_cursor = Notification.get_user_notifications(
+                str(user['_id']), parse_limit(request.args.get('limit')), request.args.get('cursor')
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify({"notifications": notifications, "next_cursor": next_cursor}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@notifications.route("/notifications/unread-count", methods=["GET"])
+@jwt_required()
+def get_unread_count():
+    try:
+        user = get_current_user()
+
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        return jsonify({"unread_count": Notification.get_unread_count(str(user['_id']))}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@notifications.route("/notifications/summary", methods=["GET"])
+@jwt_required()
+def get_notification_summary():
+    try:
+        user = get_current_user()
+
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        return jsonify({"summary": Notification.get_summary(str(user['_id']))}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @notifications.route("/notifications/<notification_id>/read", methods=["PUT"])
 @jwt_required()
 def mark_notification_read(notification_id):
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -43,30 +88,47 @@ def mark_notification_read(notification_id):
 @jwt_required()
 def mark_all_notifications_read():
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        result = Notification.mark_all_as_read(str(user['_id']))
-        return jsonify({"message": f"Marked {result.modified_count} notifications as read"}), 200
+        marked = Notification.mark_all_as_read(str(user['_id']))
+        return jsonify({"message": f"Marked {marked} notifications as read"}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@notifications.route("/notifications/read-batch", methods=["PUT"])
+@jwt_required()
+def mark_notifications_read():
+    try:
+        user = get_current_user()
+
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        try:
+            notification_ids = parse_notification_ids(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        result = Notification.mark_many_as_read(notification_ids, str(user['_id']))
+        return jsonify({"message": f"Marked {result.modified_count} notifications as read"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @notifications.route("/notifications/<notification_id>", methods=["DELETE"])
 @jwt_required()
 def delete_notification(notification_id):
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        result = Notification.delete_notification(notification_id, str(user['_id']))
-        if result.deleted_count > 0:
+        if Notification.delete_notification(notification_id, str(user['_id'])):
             return jsonify({"message": "Notification deleted"}), 200
         return jsonify({"error": "Notification not found"}), 404
         
@@ -77,8 +139,7 @@ def delete_notification(notification_id):
 @jwt_required()
 def delete_all_notifications():
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -89,12 +150,31 @@ def delete_all_notifications():
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@notifications.route("/notifications/delete-batch", methods=["DELETE"])
+@jwt_required()
+def delete_notifications():
+    try:
+        user = get_current_user()
+
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        try:
+            notification_ids = parse_notification_ids(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        deleted = Notification.delete_many(notification_ids, str(user['_id']))
+        return jsonify({"message": f"Deleted {len(deleted)} notifications"}), 200
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @notifications.route("/notifications", methods=["POST"])
 @jwt_required()
 def create_notification():
     try:
-        current_user_email = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user_email)
+        user = get_current_user()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -1,6 +1,8 @@
 from datetime import datetime
 from bson import ObjectId
+from pymongo import ReturnDocument, UpdateOne, ReplaceOne
 from shared.database import mongo
+from shared.pagination import paginate
 from marshmallow import Schema, fields, validate
 
 class ProjectSchema(Schema):
@@ -17,87 +19,356 @@ class ProjectSchema(Schema):
     project_manager = fields.Dict(required=True)  # Changed to Dict for full user details
     created_at = fields.DateTime(dump_only=True)
     updated_at = fields.DateTime(dump_only=True)
+    version = fields.Int(dump_only=True)  # Bumped by every mutation, used for ETags
     interested_users = fields.List(fields.Dict(), dump_default=[])  # New field for interested users
 
 class Project:
     schema = ProjectSchema()
+    sort_fields = {'created_at', 'updated_at', 'start_date', 'end_date', 'title'}
+    # Fields the project_stats rollup is derived from
+    stats_projection = {'status': 1, 'tech_stack': 1, 'team_members': 1}
     
     @staticmethod
     def create_project(data):
         data['created_at'] = datetime.utcnow()
         data['updated_at'] = datetime.utcnow()
+        data['version'] = 1
         result = mongo.db.projects.insert_one(data)
+        Project.bump_collection_version()
+        Project.apply_stats_delta(None, data)
         return str(result.inserted_id)
+
+    @staticmethod
+    def bump_collection_version():
+        """
+        Advance the collection-level version used for the GET /projects ETag.
+        Called after each write so a stale list is never tagged as current.
+        """
+        mongo.db.counters.update_one(
+            {'_id': 'projects'},
+            {'$inc': {'version': 1}},
+            upsert=True
+        )
+
+    @staticmethod
+    def get_collection_version():
+        counter = mongo.db.counters.find_one({'_id': 'projects'})
+        return counter['version'] if counter else 0
+
+    @staticmethod
+    def get_project_version(project_id):
+        """Read only the version counter of a project, or None if it does not exist"""
+        project = mongo.db.projects.find_one({'_id': ObjectId(project_id)}, {'version': 1})
+        return project.get('version', 0) if project else None
     
+    @staticmethod
+    def stats_keys(project):
+        """Rollup buckets a project counts towards"""
+        if not project:
+            return set()
+        keys = {('total', 'projects'), ('status', project.get('status')),
+                ('team_size', len(project.get('team_members') or []))}
+        keys.update(('tech_stack', tech) for tech in project.get('tech_stack') or [])
+        return keys
+
+    @staticmethod
+    def apply_stats_delta(before, after):
+        """
+        Keep the project_stats rollup in step with a mutation by moving the
+        project out of the buckets of its old state and into those of the new.
+        """
+        old_keys, new_keys = Project.stats_keys(before), Project.stats_keys(after)
+        operations = [
+            UpdateOne({'_id': {'dimension': dimension, 'value': value}},
+                      {'$inc': {'count': delta}}, upsert=True)
+            for keys, delta in ((new_keys - old_keys, 1), (old_keys - new_keys, -1))
+            for dimension, value in keys
+        ]
+        if operations:
+            mongo.db.project_stats.bulk_write(operations, ordered=False)
+            # Lets a concurrent rebuild_stats notice it may have overwritten this delta
+            mongo.db.counters.update_one({'_id': 'project_stats'}, {'$inc': {'deltas': 1}})
+
+    @staticmethod
+    def compute_stats():
+        """Compute portfolio statistics from the projects collection with one $facet"""
+        count = {'$sum': 1}
+        result = next(mongo.db.projects.aggregate([{'$facet': {
+            'total': [{'$count': 'count'}],
+            'status': [{'$group': {'_id': '$status', 'count': count}}],
+            'tech_stack': [
+                {'$project': {'tech': {'$setUnion': [{'$ifNull': ['$tech_stack', []]}, []]}}},
+                {'$unwind': '$tech'},
+                {'$group': {'_id': '$tech', 'count': count}}
+            ],
+            'team_size': [{'$group': {
+                '_id': {'$size': {'$ifNull': ['$team_members', []]}}, 'count': count
+            }}]
+        }}]))
+        buckets = {('total', 'projects'): result['total'][0]['count'] if result['total'] else 0}
+        for dimension in ('status', 'tech_stack', 'team_size'):
+            for bucket in result[dimension]:
+                buckets[(dimension, bucket['_id'])] = bucket['count']
+        return buckets
+
+    @staticmethod
+    def stats_delta_count():
+        """Number of deltas applied to the rollup so far, creating the marker if needed"""
+        marker = mongo.db.counters.find_one_and_update(
+            {'_id': 'project_stats'}, {'$setOnInsert': {'deltas': 0}},
+            upsert=True, return_document=ReturnDocument.AFTER
+        )
+        return marker.get('deltas', 0)
+
+    @staticmethod
+    def rebuild_stats(attempts=3):
+        """
+        Recompute the rollup from scratch, e.g. after it drifted or on first use.
+        Writing the computed counts overwrites deltas applied meanwhile, so the
+        rebuild is repeated until no delta landed while it ran.
+        """
+        for _ in range(attempts):
+            deltas = Project.stats_delta_count()
+            buckets = Project.compute_stats()
+            if buckets:
+                mongo.db.project_stats.bulk_write([
+                    ReplaceOne({'_id': {'dimension': dimension, 'value': value}},
+                               {'count': count}, upsert=True)
+                    for (dimension, value), count in buckets.items()
+                ])
+            mongo.db.project_stats.delete_many({'$nor': [
+                {'_id': {'dimension': dimension, 'value': value}} for dimension, value in buckets
+            ]})
+            if Project.stats_delta_count() == deltas:
+                # Deltas applied before the first clean rebuild only hold
+                # partial counts, so the rollup is trusted from here on
+                mongo.db.counters.update_one(
+                    {'_id': 'project_stats'}, {'$set': {'seeded_at': datetime.utcnow()}}
+                )
+                return buckets
+        print(f"Project stats rebuild raced with writes {attempts} times; will retry on the next run")
+        return buckets
+
+    @staticmethod
+    def get_stats(live=False):
+        """
+        Portfolio statistics: project count, status counts, tech stack
+        frequency and team size distribution. Served from the rollup
+        unless live is set.
+        """
+        if live:
+            buckets = Project.compute_stats()
+        elif not mongo.db.counters.find_one({'_id': 'project_stats', 'seeded_at': {'$exists': True}},
+                                            {'_id': 1}):
+            buckets = Project.rebuild_stats()
+        else:
+            buckets = {(doc['_id']['dimension'], doc['_id']['value']): doc['count']
+                       for doc in mongo.db.project_stats.find()}
+
+        stats = {'total': 0, 'status': {}, 'tech_stack': {}, 'team_size': {}}
+        for (dimension, value), count in buckets.items():
+            if dimension == 'total':
+                stats['total'] = count
+            elif count > 0:
+                stats[dimension][str(value)] = count
+        return stats
+
     @staticmethod
     def get_all_projects():
         return list(mongo.db.projects.find())
     
     @staticmethod
-    def get_project_by_id(project_id):
-        return mongo.db.projects.find_one({'_id': ObjectId(project_id)})
+    def build_query(status=None, tech=None, start_after=None, start_before=None,
+                    end_after=None, end_before=None):
+        """
+        Translate list filters into a MongoDB filter.
+        status and tech accept comma separated values: any of the statuses,
+        all of the technologies.
+        """
+        query = {}
+        if status:
+            statuses = [s.strip() for s in status.split(',') if s.strip()]
+            query['status'] = statuses[0] if len(statuses) == 1 else {'$in': statuses}
+        if tech:
+            techs = [t.strip() for t in tech.split(',') if t.strip()]
+            query['tech_stack'] = techs[0] if len(techs) == 1 else {'$all': techs}
+
+        for field, after, before in (('start_date', start_after, start_before),
+                                     ('end_date', end_after, end_before)):
+            date_range = {}
+            if after:
+                date_range['$gte'] = Project.parse_date(after)
+            if before:
+                date_range['$lte'] = Project.parse_date(before)
+            if date_range:
+                query[field] = date_range
+        return query
+
+    @staticmethod
+    def parse_date(value):
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            raise ValueError(f"Invalid date '{value}', expected ISO 8601")
+
+    @staticmethod
+    def find_projects(query, sort_field='created_at', direction=-1, limit=None, cursor=None,
+                      projection=None):
+        """Return a page of projects matching query and the cursor of the next page"""
+        return paginate(mongo.db.projects, query, sort_field, direction, limit, cursor, projection)
     
     @staticmethod
-    def update_project(project_id, data):
+    def get_project_by_id(project_id, projection=None):
+        return mongo.db.projects.find_one({'_id': ObjectId(project_id)}, projection)
+    
+    @staticmethod
+    def update_project(project_id, data, precondition=None, projection=None):
         """
-        If data contains a $push operation, handle it differently from regular updates
+        Update a project in a single round trip with findOneAndUpdate.
+        If data contains a $push operation, handle it differently from regular updates.
+        Returns the project as it was before the update (limited to projection),
+        or None when no project matches project_id and the optional precondition.
         """
         if any(key.startswith('$') for key in data.keys()):
             # This is an update operation (like $push)
-            return mongo.db.projects.update_one(
-                {'_id': ObjectId(project_id)},
-                data  # data already contains the update operator
-            )
+            update = dict(data)  # data already contains the update operator
+            update['$inc'] = {**update.get('$inc', {}), 'version': 1}
         else:
             # This is a regular update
             data['updated_at'] = datetime.utcnow()
-            return mongo.db.projects.update_one(
-                {'_id': ObjectId(project_id)},
-                {'$set': data}  # wrap regular updates in $set
-            )
+            update = {'$set': data, '$inc': {'version': 1}}  # wrap regular updates in $set
+        if projection is not None:
+            projection = {**projection, **Project.stats_projection}
+        before = mongo.db.projects.find_one_and_update(
+            {'_id': ObjectId(project_id), **(precondition or {})},
+            update,
+            projection=projection,
+            return_document=ReturnDocument.BEFORE
+        )
+        if before is not None:
+            Project.bump_collection_version()
+            Project.apply_stats_delta(before, Project.stats_after_update(before, update))
+        return before
+
+    @staticmethod
+    def stats_after_update(before, update):
+        """Derive the rollup-relevant fields of a project after update was applied"""
+        after = {'status': before.get('status'),
+                 'tech_stack': before.get('tech_stack'),
+                 'team_members': list(before.get('team_members') or [])}
+        for field, value in update.get('$set', {}).items():
+            if field in after:
+                after[field] = value
+        pushed = update.get('$push', {}).get('team_members')
+        if pushed is not None:
+            after['team_members'] += pushed['$each'] if isinstance(pushed, dict) and '$each' in pushed else [pushed]
+        return after
     
     @staticmethod
     def delete_project(project_id):
-        return mongo.db.projects.delete_one({'_id': ObjectId(project_id)})
+        """Delete a project and return it (rollup fields only), or None if it did not exist"""
+        deleted = mongo.db.projects.find_one_and_delete(
+            {'_id': ObjectId(project_id)}, projection=Project.stats_projection
+        )
+        if deleted is not None:
+            Project.bump_collection_version()
+            Project.apply_stats_delta(deleted, None)
+        return deleted
     
     @staticmethod
-    def get_projects_by_member(user_id):
-        return list(mongo.db.projects.find({'team_members': user_id})) 
+    def get_projects_by_member(user_id, email, limit=None, cursor=None, projection=None):
+        """
+        Projects where the user is a team member or the project manager,
+        newest first. Each $or branch is served by its own multikey index.
+        """
+        query = {'$or': [
+            {'team_members.user_id': user_id},
+            {'team_members.email': email},
+            {'project_manager.user_id': user_id},
+            {'project_manager.email': email}
+        ]}
+        return paginate(mongo.db.projects, query, 'created_at', -1, limit, cursor,
+                        projection or {'interested_users': 0})
 
     @staticmethod
     def add_interested_user(project_id, user_details):
         """Add a user to the project's interested list"""
-        return mongo.db.projects.update_one(
+        result = mongo.db.projects.update_one(
             {'_id': ObjectId(project_id)},
-            {'$push': {'interested_users': user_details}}
+            {'$push': {'interested_users': user_details}, '$inc': {'version': 1}}
         )
+        if result.modified_count:
+            Project.bump_collection_version()
+        return result
 
     @staticmethod
     def remove_interested_user(project_id, user_id):
         """Remove a user from the project's interested list"""
-        return mongo.db.projects.update_one(
-            {'_id': ObjectId(project_id)},
-            {'$pull': {'interested_users': {'user_id': user_id}}}
+        result = mongo.db.projects.update_one(
+            {'_id': ObjectId(project_id), 'interested_users.user_id': user_id},
+            {'$pull': {'interested_users': {'user_id': user_id}}, '$inc': {'version': 1}}
         )
+        if result.modified_count:
+            Project.bump_collection_version()
+        return result
 
     @staticmethod
-    def accept_interested_user(project_id, user_details):
-        """Accept an interested user by adding them to team members and removing from interested list"""
-        return mongo.db.projects.update_one(
-            {'_id': ObjectId(project_id)},
+    def accept_interested_user(project_id, user_id, manager_email):
+        """
+        Move an interested user to the team members, provided manager_email
+        is the project manager. The entry is moved server-side with a pipeline
+        update, so the check and the write are a single atomic round trip.
+        Returns the pre-image with the accepted user's entry, or None.
+        """
+        before = mongo.db.projects.find_one_and_update(
             {
-                '$push': {'team_members': user_details},
-                '$pull': {'interested_users': {'user_id': user_details['user_id']}}
-            }
+                '_id': ObjectId(project_id),
+                'project_manager.email': manager_email,
+                'interested_users.user_id': user_id
+            },
+            [{'$set': {
+                'team_members': {'$concatArrays': [
+                    {'$ifNull': ['$team_members', []]},
+                    {'$filter': {
+                        'input': '$interested_users',
+                        'cond': {'$eq': ['$$this.user_id', user_id]}
+                    }}
+                ]},
+                'interested_users': {'$filter': {
+                    'input': '$interested_users',
+                    'cond': {'$ne': ['$$this.user_id', user_id]}
+                }},
+                'version': {'$add': [{'$ifNull': ['$version', 0]}, 1]}
+            }}],
+            projection={'title': 1, 'status': 1, 'tech_stack': 1, 'team_members.user_id': 1,
+                        'interested_users': {'$elemMatch': {'user_id': user_id}}},
+            return_document=ReturnDocument.BEFORE
         )
+        if before is not None:
+            Project.bump_collection_version()
+            after = {**before, 'team_members': (before.get('team_members') or []) + before['interested_users']}
+            Project.apply_stats_delta(before, after)
+        return before
 
     @staticmethod
-    def reject_interested_user(project_id, user_id):
-        """Reject an interested user by removing them from interested list"""
-        return mongo.db.projects.update_one(
-            {'_id': ObjectId(project_id)},
-            {'$pull': {'interested_users': {'user_id': user_id}}}
+    def reject_interested_user(project_id, user_id, manager_email):
+        """
+        Remove a user from the interested list, provided manager_email is the
+        project manager. Returns the pre-image (title only) or None.
+        """
+        before = mongo.db.projects.find_one_and_update(
+            {
+                '_id': ObjectId(project_id),
+                'project_manager.email': manager_email,
+                'interested_users.user_id': user_id
+            },
+            {'$pull': {'interested_users': {'user_id': user_id}}, '$inc': {'version': 1}},
+            projection={'title': 1},
+            return_document=ReturnDocument.BEFORE
         )
+        if before is not None:
+            Project.bump_collection_version()
+        return before
 
     @staticmethod
     def is_user_interested(project, user_id):
@@ -1,13 +1,20 @@
 from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
+from auth.jwt_utils import get_current_user, get_current_author
 from projects.models import Project
 from marshmallow import ValidationError
 from bson import ObjectId
 from users.models import UserService
 from notifications.models import Notification
+from shared.pagination import DEFAULT_PAGE_SIZE, parse_limit, parse_sort
+from shared.projection import parse_fields
+from shared.etag import make_etag, is_not_modified, not_modified, tagged_json
 
 projects = Blueprint("projects", __name__)
 
+# Fields needed to build the user snapshots embedded in a project
+MEMBER_FIELDS = ['email', 'name']
+
 @projects.route("/projects", methods=["POST"])
 @jwt_required()
 def create_project():
@@ -15,27 +22,24 @@ def create_project():
         data = request.get_json()
         current_user = get_jwt_identity()
         
+        # Resolve team members and project manager in a single query
+        member_ids = data.get('team_members', [])
+        pm_id = data.get('project_manager')
+        users_by_id = UserService.get_users_by_ids(
+            member_ids + ([pm_id] if pm_id else []), MEMBER_FIELDS
+        )
+
         # Convert team member IDs to full user details
-        team_member_details = []
-        for member_id in data.get('team_members', []):
-            user = UserService.get_user_by_id(member_id)
-            if user:
-                team_member_details.append({
-                    'user_id': str(user['_id']),
-                    'email': user['email'],
-                    'name': user['name']
-                })
+        team_member_details = [
+            UserService.to_member(users_by_id[member_id])
+            for member_id in member_ids if member_id in users_by_id
+        ]
         
         # Get project manager details
-        pm_id = data.get('project_manager')
         if pm_id:
-            pm_user = UserService.get_user_by_id(pm_id)
+            pm_user = users_by_id.get(pm_id)
             if pm_user:
-                data['project_manager'] = {
-                    'user_id': str(pm_user['_id']),
-                    'email': pm_user['email'],
-                    'name': pm_user['name']
-                }
+                data['project_manager'] = UserService.to_member(pm_user)
             else:
                 return jsonify({"error": "Project manager not found"}), 404
         
@@ -49,13 +53,12 @@ def create_project():
         project_id = Project.create_project(validated_data)
         
         # Notify team members about new project
-        for member in team_member_details:
-            Notification.create_notification(
-                member['user_id'],
-                'new_project',
-                f"New project '{validated_data['title']}' has been created",
-                project_id
-            )
+        Notification.fan_out(
+            [member['user_id'] for member in team_member_details],
+            'new_project',
+            f"New project '{validated_data['title']}' has been created",
+            project_id
+        )
         
         return jsonify({
             "message": "Project created successfully",
@@ -71,23 +74,48 @@ def create_project():
 @jwt_required()
 def get_projects():
     try:
-        # Get query parameters for filtering
-        status = request.args.get('status')
-        tech = request.args.get('tech')
-        
-        projects = Project.get_all_projects()
-        
-        # Apply filters if provided
-        if status:
-            projects = [p for p in projects if p['status'] == status]
-        if tech:
-            projects = [p for p in projects if tech in p['tech_stack']]
+        # Filters, sort order and page size are pushed down into the Mongo query
+        try:
+            query = Project.build_query(
+                status=request.args.get('status'),
+                tech=request.args.get('tech'),
+                start_after=request.args.get('start_after'),
+                start_before=request.args.get('start_before'),
+                end_after=request.args.get('end_after'),
+                end_before=request.args.get('end_before')
+            )
+            sort_field, direction = parse_sort(request.args.get('sort'), Project.sort_fields, '-created_at')
+            limit = parse_limit(request.args.get('limit'))
+            projection = parse_fields(request.args.get('fields'), Project.schema.fields)
+
+            # Read the collection version before the data so a concurrent
+            # write can only make the ETag older, never newer than the page
+            etag = make_etag('projects', Project.get_collection_version(), request.query_string.decode())
+            if is_not_modified(etag):
+                return not_modified(etag)
+
+            projects, next_cursor = Project.find_projects(
+                query, sort_field, direction, limit, request.args.get('cursor'), projection
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Convert ObjectId to string for JSON serialization
         for project in projects:
             project['_id'] = str(project['_id'])
         
-        return jsonify({"projects": projects}), 200
+        return tagged_json({"projects": projects, "next_cursor": next_cursor}, etag)
+        
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@projects.route("/projects/stats", methods=["GET"])
+@jwt_required()
+def get_project_stats():
+    try:
+        # ?live=true recomputes from the collection instead of the rollup
+        live = request.args.get('live', '').lower() == 'true'
+        return jsonify({"stats": Project.get_stats(live)}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -96,12 +124,21 @@ def get_projects():
 @jwt_required()
 def get_project(project_id):
     try:
+        # Revalidation only needs the version counter, not the whole document
+        if request.if_none_match:
+            version = Project.get_project_version(project_id)
+            if version is None:
+                return jsonify({"error": "Project not found"}), 404
+            etag = make_etag('project', project_id, version)
+            if is_not_modified(etag):
+                return not_modified(etag)
+
         project = Project.get_project_by_id(project_id)
         if not project:
             return jsonify({"error": "Project not found"}), 404
             
         project['_id'] = str(project['_id'])
-        return jsonify({"project": project}), 200
+        return tagged_json({"project": project}, make_etag('project', project_id, project.get('version', 0)))
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -112,67 +149,65 @@ def update_project(project_id):
     try:
         data = request.get_json()
         
+        # Resolve updated team members and project manager in a single query
+        member_ids = data.get('team_members') or []
+        pm_id = data.get('project_manager')
+        users_by_id = UserService.get_users_by_ids(
+            member_ids + ([pm_id] if pm_id else []), MEMBER_FIELDS
+        )
+
         # If team_members are being updated
+        team_member_details = []
         if 'team_members' in data:
             # Convert team member IDs to full user details
-            team_member_details = []
-            for member_id in data.get('team_members', []):
-                user = UserService.get_user_by_id(member_id)
-                if user:
-                    team_member_details.append({
-                        'user_id': str(user['_id']),
-                        'email': user['email'],
-                        'name': user['name']
-                    })
+            team_member_details = [
+                UserService.to_member(users_by_id[member_id])
+                for member_id in member_ids if member_id in users_by_id
+            ]
             data['team_members'] = team_member_details
 
         # If project_manager is being updated
         if 'project_manager' in data:
-            pm_id = data.get('project_manager')
             if pm_id:
-                pm_user = UserService.get_user_by_id(pm_id)
+                pm_user = users_by_id.get(pm_id)
                 if pm_user:
-                    data['project_manager'] = {
-                        'user_id': str(pm_user['_id']),
-                        'email': pm_user['email'],
-                        'name': pm_user['name']
-                    }
+                    data['project_manager'] = UserService.to_member(pm_user)
                 else:
                     return jsonify({"error": "Project manager not found"}), 404
             
-        # Get existing project to compare team members
-        existing_project = Project.get_project_by_id(project_id)
-        if existing_project:
+        # Validate update data
+        validated_data = Project.schema.load(data, partial=True)
+        
+        # One round trip: the pre-image drives the membership notifications
+        existing_project = Project.update_project(
+            project_id, validated_data, projection={'title': 1, 'team_members': 1}
+        )
+        if existing_project is None:
+            return jsonify({"error": "Project not found"}), 404
+
+        if 'team_members' in data:
             existing_member_ids = {member['user_id'] for member in existing_project.get('team_members', [])}
             new_member_ids = {member['user_id'] for member in team_member_details}
+            title = validated_data.get('title', existing_project['title'])
             
             # Notify new team members
-            for member in team_member_details:
-                if member['user_id'] not in existing_member_ids:
-                    Notification.create_notification(
-                        member['user_id'],
-                        'added_to_project',
-                        f"You have been added to project '{existing_project['title']}'",
-                        project_id
-                    )
+            Notification.fan_out(
+                [member['user_id'] for member in team_member_details
+                 if member['user_id'] not in existing_member_ids],
+                'added_to_project',
+                f"You have been added to project '{title}'",
+                project_id
+            )
             
             # Notify removed members
-            for member in existing_project.get('team_members', []):
-                if member['user_id'] not in new_member_ids:
-                    Notification.create_notification(
-                        member['user_id'],
-                        'removed_from_project',
-                        f"You have been removed from project '{existing_project['title']}'",
-                        project_id
-                    )
-        
-        # Validate update data
-        validated_data = Project.schema.load(data, partial=True)
-        
-        result = Project.update_project(project_id, validated_data)
-        if result.modified_count == 0:
-            return jsonify({"error": "Project not found"}), 404
-            
+            Notification.fan_out(
+                [member['user_id'] for member in existing_project.get('team_members', [])
+                 if member['user_id'] not in new_member_ids],
+                'removed_from_project',
+                f"You have been removed from project '{title}'",
+                project_id
+            )
+
         return jsonify({"message": "Project updated successfully"}), 200
         
     except ValidationError as err:
@@ -184,8 +219,7 @@ def update_project(project_id):
 @jwt_required()
 def delete_project(project_id):
     try:
-        result = Project.delete_project(project_id)
-        if result.deleted_count == 0:
+        if Project.delete_project(project_id) is None:
             return jsonify({"error": "Project not found"}), 404
             
         return jsonify({"message": "Project deleted successfully"}), 200
@@ -197,14 +231,24 @@ def delete_project(project_id):
 @jwt_required()
 def get_my_projects():
     try:
-        current_user = get_jwt_identity()
-        projects = Project.get_projects_by_member(current_user)
+        user = get_current_user()
+        if not user:
+            return jsonify({"error": "User not found"}), 404
+
+        try:
+            limit = parse_limit(request.args.get('limit'), DEFAULT_PAGE_SIZE)
+            projection = parse_fields(request.args.get('fields'), Project.schema.fields)
+            projects, next_cursor = Project.get_projects_by_member(
+                str(user['_id']), user['email'], limit, request.args.get('cursor'), projection
+            )
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
         
         # Convert ObjectId to string for JSON serialization
         for project in projects:
             project['_id'] = str(project['_id'])
             
-        return jsonify({"projects": projects}), 200
+        return jsonify({"projects": projects, "next_cursor": next_cursor}), 200
         
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -226,40 +270,29 @@ def add_team_member(project_id):
         if not user:
             return jsonify({"error": "User not found"}), 404
 
-        project = Project.get_project_by_id(project_id)
-        if not project:
-            return jsonify({"error": "Project not found"}), 404
-
         # Add user to team members
-        team_member_details = {
-            'user_id': str(user['_id']),
-            'email': user['email'],
-            'name': user['name']
-        }
-        
-        # Check if user is already a team member
-        if any(tm['user_id'] == str(user['_id']) for tm in project.get('team_members', [])):
+        team_member_details = UserService.to_member(user)
+
+        # Push only if the user is not already a team member, in one round trip
+        project = Project.update_project(
+            project_id,
+            {'$push': {'team_members': team_member_details}},
+            precondition={'team_members.user_id': {'$ne': str(user['_id'])}},
+            projection={'title': 1}
+        )
+        if project is None:
+            if Project.get_project_version(project_id) is None:
+                return jsonify({"error": "Project not found"}), 404
             return jsonify({"error": "User is already a team member"}), 400
 
-        # Use the update operator directly
-        update_operation = {
-            '$push': {
-                'team_members': team_member_details
-            }
-        }
-        
-        result = Project.update_project(project_id, update_operation)
-
-        if result.modified_count:
-            # Create notification for the user
-            Notification.create_notification(
-                str(user['_id']),
-                'added_to_project',
-                f"You have been added to project '{project['title']}'",
-                project_id
-            )
-            return jsonify({"message": "User added to project successfully"}), 200
-        return jsonify({"error": "Failed to add user to project"}), 400
+        # Create notification for the user
+        Notification.fan_out(
+            [str(user['_id'])],
+            'added_to_project',
+            f"You have been added to project '{project['title']}'",
+            project_id
+        )
+        return jsonify({"message": "User added to project successfully"}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -268,8 +301,7 @@ def add_team_member(project_id):
 @jwt_required()
 def add_interested_user(project_id):
     try:
-        current_user = get_jwt_identity()
-        user = UserService.get_user_by_email(current_user)
+        user = get_current_author()
         
         if not user:
             return jsonify({"error": "User not found"}), 404
@@ -323,8 +355,12 @@ def get_interested_users(project_id):
         interested_users = project.get('interested_users', [])
         detailed_interested_users = []
 
+        # Fetch skills and experience for every interested user in one query
+        users_by_id = UserService.get_users_by_ids(
+            [user['user_id'] for user in interested_users], ['skills', 'experience']
+        )
         for user in interested_users:
-            user_details = UserService.get_user_by_id(user['user_id'])
+            user_details = users_by_id.get(user['user_id'])
             if user_details:
                 user['skills'] = user_details.get('skills', [])
                 user['experience'] = user_details.get('experience')
@@ -340,31 +376,20 @@ def get_interested_users(project_id):
 def accept_interested_user(project_id, user_id):
     try:
         current_user = get_jwt_identity()
-        project = Project.get_project_by_id(project_id)
-
-        if not project:
-            return jsonify({"error": "Project not found"}), 404
-
-        # Verify if current user is project manager
-        if project['project_manager']['email'] != current_user:
-            return jsonify({"error": "Unauthorized. Only project manager can accept users"}), 403
 
-        user_to_accept = Project.get_interested_user(project, user_id)
-        if not user_to_accept:
-            return jsonify({"error": "User not found in interested list"}), 404
+        # Authorization, membership check and the move happen in one atomic update
+        project = Project.accept_interested_user(project_id, user_id, current_user)
+        if project is None:
+            return interested_update_error(project_id, current_user, "accept")
 
-        result = Project.accept_interested_user(project_id, user_to_accept)
-
-        if result.modified_count:
-            # Create notification for accepted user
-            Notification.create_notification(
-                user_id,
-                'project_acceptance',
-                f"You have been accepted to join project '{project['title']}'",
-                project_id
-            )
-            return jsonify({"message": "User accepted and added to team successfully"}), 200
-        return jsonify({"error": "Failed to accept user"}), 400
+        # Create notification for accepted user
+        Notification.create_notification(
+            user_id,
+            'project_acceptance',
+            f"You have been accepted to join project '{project['title']}'",
+            project_id
+        )
+        return jsonify({"message": "User accepted and added to team successfully"}), 200
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -374,27 +399,28 @@ def accept_interested_user(project_id, user_id):
 def reject_interested_user(project_id, user_id):
     try:
         current_user = get_jwt_identity()
-        project = Project.get_project_by_id(project_id)
 
-        if not project:
-            return jsonify({"error": "Project not found"}), 404
-
-        # Verify if current user is project manager
-        if project['project_manager']['email'] != current_user:
-            return jsonify({"error": "Unauthorized. Only project manager can reject users"}), 403
+        project = Project.reject_interested_user(project_id, user_id, current_user)
+        if project is None:
+            return interested_update_error(project_id, current_user, "reject")
 
-        result = Project.reject_interested_user(project_id, user_id)
-
-        if result.modified_count:
-            # Create notification for rejected user
-            Notification.create_notification(
-                user_id,
-                'project_rejection',
-                f"Your request to join project '{project['title']}' has been declined",
-                project_id
-            )
-            return jsonify({"message": "User rejected successfully"}), 200
-        return jsonify({"error": "User not found in interested list"}), 404
+        # Create notification for rejected user
+        Notification.create_notification(
+            user_id,
+            'project_rejection',
+            f"Your request to join project '{project['title']}' has been declined",
+            project_id
+        )
+        return jsonify({"message": "User rejected successfully"}), 200
 
     except Exception as e:
-        return jsonify({"error": str(e)}), 500 
\ No newline at end of file
+        return jsonify({"error": str(e)}), 500
+
+def interested_update_error(project_id, current_user, action):
+    """Explain why a conditional accept/reject matched no project (failure path only)"""
+    project = Project.get_project_by_id(project_id)
+    if not project:
+        return jsonify({"error": "Project not found"}), 404
+    if project['project_manager']['email'] != current_user:
+        return jsonify({"error": f"Unauthorized. Only project manager can {action} users"}), 403
+    return jsonify({"error": "User not found in interested list"}), 404
@@ -0,0 +1,28 @@
+import eventlet
+eventlet.monkey_patch()
+
+from flask import Flask, jsonify
+from flask_jwt_extended import JWTManager
+from shared.database import init_db
+from shared.config import MONGO_URI, JWT_SECRET_KEY, PUSH_PORT
+from notifications.push import create_socket_app
+
+# Socket.IO server for real-time notifications, run apart from the API:
+#   gunicorn --worker-class eventlet --workers 1 --bind 0.0.0.0:5001 push_server:application
+# Every connection is a green thread, so idle tabs cost memory, not threads.
+# With more than one process PUSH_BACKEND must be "mongo".
+
+app = Flask(__name__)
+app.config["MONGO_URI"] = MONGO_URI
+app.config["JWT_SECRET_KEY"] = JWT_SECRET_KEY
+
+init_db(app)
+JWTManager(app)
+application = create_socket_app(app, 'eventlet')
+
+@app.route('/health')
+def health_check():
+    return jsonify({"status": "healthy"})
+
+if __name__ == "__main__":
+    eventlet.wsgi.server(eventlet.listen(('0.0.0.0', PUSH_PORT)), application)
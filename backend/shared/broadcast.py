@@ -0,0 +1,96 @@
+import threading
+import time
+from datetime import datetime
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid
+from shared.database import mongo
+
+# Publish/subscribe between app processes. Every process subscribes the
+# handlers that deliver messages to its own connected clients, and publish()
+# reaches the subscribers of every process sharing the backend.
+
+class MemoryBroadcaster:
+    """Delivers to subscribers of this process only; enough for one worker and for tests"""
+
+    def __init__(self):
+        self._subscribers = []
+
+    def subscribe(self, handler):
+        self._subscribers.append(handler)
+
+    def publish(self, channel, message):
+        for handler in self._subscribers:
+            handler(channel, message)
+
+    def start(self):
+        pass
+
+class MongoBroadcaster:
+    """
+    Messages go through a capped collection that each process follows with
+    a tailable cursor, so every gunicorn worker and replica sees them
+    without a separate message broker.
+    """
+
+    def __init__(self, collection='broadcasts', size=16 * 1024 * 1024, poll_interval=1):
+        self.collection_name = collection
+        self.size = size
+        self.poll_interval = poll_interval
+        self._subscribers = []
+        self._listener = None
+        self._ensured = False
+
+    @property
+    def collection(self):
+        return mongo.db[self.collection_name]
+
+    def subscribe(self, handler):
+        self._subscribers.append(handler)
+
+    def publish(self, channel, message):
+        # A publisher may run before any listener; inserting first would
+        # create an uncapped collection that can never be tailed
+        self.ensure_collection()
+        self.collection.insert_one({'channel': channel, 'message': message, 'created_at': datetime.utcnow()})
+
+    def ensure_collection(self):
+        if self._ensured:
+            return
+        try:
+            mongo.db.create_collection(self.collection_name, capped=True, size=self.size)
+        except CollectionInvalid:
+            pass
+        self._ensured = True
+
+    def start(self):
+        """Start following the collection in a daemon thread"""
+        if self._listener is not None:
+            return
+        self.ensure_collection()
+        self._listener = threading.Thread(target=self.listen, name='broadcast', daemon=True)
+        self._listener.start()
+
+    def listen(self):
+        # Only messages published after this process started are delivered
+        latest = self.collection.find_one(sort=[('$natural', -1)], projection={'_id': 1})
+        last_id = latest['_id'] if latest else None
+        while True:
+            try:
+                query = {'_id': {'$gt': last_id}} if last_id else {}
+                cursor = self.collection.find(query, cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for entry in cursor:
+                        last_id = entry['_id']
+                        for handler in self._subscribers:
+                            handler(entry['channel'], entry['message'])
+            except Exception as e:
+                print(f"Broadcast listener error: {str(e)}")
+            # A tailable cursor dies when the collection is empty or was dropped
+            time.sleep(self.poll_interval)
+
+def create_broadcaster(backend):
+    if backend == 'mongo':
+        return MongoBroadcaster()
+    if backend == 'memory':
+        return MemoryBroadcaster()
+    raise ValueError(f"Unknown broadcast backend '{backend}'")
@@ -7,3 +7,51 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGO_URI")
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 JWT_ACCESS_TOKEN_EXPIRES = timedelta(hours=24)
+
+# Apply the index registry (shared/indexes.py) when the app boots
+ENSURE_INDEXES_ON_STARTUP = os.getenv("ENSURE_INDEXES_ON_STARTUP", "true").lower() == "true"
+
+# Deferred task outbox (see shared/tasks.py)
+TASK_MODE = os.getenv("TASK_MODE", "thread")
+TASK_BATCH_SIZE = int(os.getenv("TASK_BATCH_SIZE", "50"))
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "5"))
+TASK_POLL_INTERVAL = float(os.getenv("TASK_POLL_INTERVAL", "2"))
+
+# Per-process cache of authenticated user lookups (see UserService.get_user_by_email)
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "1024"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))
+
+# How long a worker trusts its cached copy of a user's token_version (see auth/jwt_utils.py)
+TOKEN_VERSION_CACHE_TTL = float(os.getenv("TOKEN_VERSION_CACHE_TTL", "30"))
+
+# Throttling of the user snapshot propagation task (see users/propagation.py)
+PROPAGATION_BATCH_SIZE = int(os.getenv("PROPAGATION_BATCH_SIZE", "500"))
+PROPAGATION_PAUSE = float(os.getenv("PROPAGATION_PAUSE", "0.05"))
+
+# Password hashing (see auth/bcrypt_utils.py)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+BCRYPT_MAX_CONCURRENCY = int(os.getenv("BCRYPT_MAX_CONCURRENCY", "2"))
+BCRYPT_MAX_QUEUE = int(os.getenv("BCRYPT_MAX_QUEUE", "16"))
+
+# Login throttling (see shared/ratelimit.py): "memory" per process or "mongo" shared by replicas
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory")
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+LOGIN_IP_BURST = int(os.getenv("LOGIN_IP_BURST", "20"))
+LOGIN_IP_PER_MINUTE = float(os.getenv("LOGIN_IP_PER_MINUTE", "10"))
+LOGIN_ACCOUNT_BURST = int(os.getenv("LOGIN_ACCOUNT_BURST", "5"))
+LOGIN_ACCOUNT_PER_MINUTE = float(os.getenv("LOGIN_ACCOUNT_PER_MINUTE", "1"))
+
+# Real-time notification push (see notifications/push.py). PUSH_BACKEND is
+# "memory" for a single process or "mongo" to reach clients connected to any
+# worker or replica, and to the task worker when TASK_MODE is external.
+# Sockets are served by push_server.py on PUSH_PORT; SOCKETIO_IN_APP serves
+# them from the API process instead, for local development.
+PUSH_BACKEND = os.getenv("PUSH_BACKEND", "memory")
+SOCKETIO_IN_APP = os.getenv("SOCKETIO_IN_APP", "false").lower() == "true"
+PUSH_PORT = int(os.getenv("PUSH_PORT", "5001"))
+SOCKETIO_CORS_ORIGINS = os.getenv("SOCKETIO_CORS_ORIGINS", "*")
+
+# Notification retention (see Notification.retention): read notifications
+# expire after this many days, unread ones are rolled up into a summary
+NOTIFICATION_READ_RETENTION_DAYS = int(os.getenv("NOTIFICATION_READ_RETENTION_DAYS", "30"))
+NOTIFICATION_UNREAD_RETENTION_DAYS = int(os.getenv("NOTIFICATION_UNREAD_RETENTION_DAYS", "90"))
@@ -0,0 +1,21 @@
+import hashlib
+from flask import request, jsonify, make_response
+
+def make_etag(*parts):
+    """Build a strong ETag value from version counters and request parameters"""
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+def is_not_modified(etag):
+    """True when the client's If-None-Match already holds this ETag"""
+    return request.if_none_match.contains(etag)
+
+def not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+def tagged_json(payload, etag, status=200):
+    """jsonify payload and attach a strong ETag"""
+    response = make_response(jsonify(payload), status)
+    response.set_etag(etag)
+    return response
@@ -0,0 +1,115 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from shared.database import mongo
+
+# Every index the application relies on, per collection.
+# ensure_indexes() applies them idempotently at boot or via `flask create-indexes`,
+# and index_drift() reports differences between this registry and the database.
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], unique=True),
+        # Directory order and name prefix search for GET /users
+        IndexModel([('name_lower', ASCENDING), ('_id', ASCENDING)]),
+        # Staffing search for GET /users/search
+        IndexModel([('skills_normalized', ASCENDING)]),
+        IndexModel([('designation_lower', ASCENDING), ('skills_normalized', ASCENDING)]),
+    ],
+    'password_reset_tokens': [
+        # _id is the SHA-256 of the token, so lookups are a unique point read
+        IndexModel([('user_id', ASCENDING)]),
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'projects': [
+        IndexModel([('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('status', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('tech_stack', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('start_date', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('end_date', ASCENDING), ('_id', ASCENDING)]),
+        # Membership lookups for /projects/user/my-projects
+        IndexModel([('team_members.user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('team_members.email', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('project_manager.user_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('project_manager.email', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        # Snapshot propagation (users/propagation.py)
+        IndexModel([('interested_users.user_id', ASCENDING)]),
+    ],
+    'comments': [
+        IndexModel([('project_id', ASCENDING), ('created_at', DESCENDING), ('_id', DESCENDING)]),
+        IndexModel([('user_id', ASCENDING)]),
+        IndexModel([('replies.user_id', ASCENDING)]),
+    ],
+    'comment_replies': [
+        IndexModel([('comment_id', ASCENDING), ('created_at', ASCENDING), ('_id', ASCENDING)]),
+        IndexModel([('user_id', ASCENDING)]),
+    ],
+    'notifications': [
+        IndexModel([('user_id', ASCENDING), ('updated_at', DESCENDING), ('_id', DESCENDING)]),
+        # Coalescing of unread notifications (Notification.coalesce_key)
+        IndexModel([('user_id', ASCENDING), ('type', ASCENDING), ('reference_id', ASCENDING)],
+                   partialFilterExpression={'is_read': False}),
+        # Retention (Notification.retention): read ones expire, old unread ones are rolled up
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+        IndexModel([('updated_at', ASCENDING)], partialFilterExpression={'is_read': False}),
+    ],
+    'knowledge_base': [
+        IndexModel([('project_id', ASCENDING)]),
+        IndexModel([('created_by.user_id', ASCENDING)]),
+    ],
+    'rate_limits': [
+        # Buckets are dropped once they would have refilled completely
+        IndexModel([('expires_at', ASCENDING)], expireAfterSeconds=0),
+    ],
+    'task_outbox': [
+        IndexModel([('status', ASCENDING), ('run_after', ASCENDING)]),
+        # Failed tasks are kept for inspection for 30 days
+        IndexModel(
+            [('created_at', ASCENDING)],
+            expireAfterSeconds=30 * 24 * 3600,
+            partialFilterExpression={'status': 'failed'}
+        ),
+    ],
+}
+
+# Index options that make two indexes with the same keys different
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+def _describe(spec):
+    """Normalize an index definition into (keys, options) for comparison"""
+    keys = [(field, direction) for field, direction in spec['key'].items()] \
+        if isinstance(spec['key'], dict) else list(spec['key'])
+    options = {option: spec[option] for option in COMPARED_OPTIONS if option in spec}
+    return keys, options
+
+def ensure_indexes(db=None):
+    """Create every declared index; existing identical indexes are left untouched"""
+    db = db if db is not None else mongo.db
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = db[collection].create_indexes(models)
+    return created
+
+def index_drift(db=None):
+    """
+    Compare declared and live indexes.
+    Returns {collection: {'missing': [...], 'extra': [...], 'changed': [...]}}
+    for every collection that differs from the registry.
+    """
+    db = db if db is not None else mongo.db
+    drift = {}
+    for collection, models in INDEXES.items():
+        declared = {model.document['name']: _describe(model.document) for model in models}
+        live = {
+            name: _describe(info)
+            for name, info in db[collection].index_information().items()
+            if name != '_id_'
+        }
+        report = {
+            'missing': sorted(name for name in declared if name not in live),
+            'extra': sorted(name for name in live if name not in declared),
+            'changed': sorted(
+                name for name in declared
+                if name in live and declared[name] != live[name]
+            ),
+        }
+        if any(report.values()):
+            drift[collection] = report
+    return drift
@@ -0,0 +1,91 @@
+import base64
+from bson import json_util
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+def parse_limit(raw_limit, default=None, maximum=MAX_PAGE_SIZE):
+    """Parse a ?limit= query value, clamping it to the allowed page size"""
+    if raw_limit in (None, ''):
+        return default
+    try:
+        limit = int(raw_limit)
+    except (TypeError, ValueError):
+        raise ValueError("limit must be an integer")
+    if limit < 1:
+        raise ValueError("limit must be a positive integer")
+    return min(limit, maximum)
+
+def parse_sort(raw_sort, allowed_fields, default):
+    """Parse a ?sort= value such as '-created_at' into (field, direction)"""
+    raw_sort = raw_sort or default
+    direction = -1 if raw_sort.startswith('-') else 1
+    field = raw_sort.lstrip('-+')
+    if field not in allowed_fields:
+        raise ValueError(f"Cannot sort by '{field}'")
+    return field, direction
+
+def encode_cursor(document, sort_field):
+    """Build an opaque cursor from the last document of a page"""
+    payload = json_util.dumps([document.get(sort_field), document['_id']])
+    return base64.urlsafe_b64encode(payload.encode()).decode()
+
+def decode_cursor(cursor):
+    """Return the (sort value, _id) pair stored in a cursor"""
+    try:
+        value, last_id = json_util.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+    except Exception:
+        raise ValueError("Invalid cursor")
+    return value, last_id
+
+def keyset_filter(sort_field, direction, value, last_id):
+    """Filter matching documents that sort strictly after (value, last_id)"""
+    op = '$gt' if direction == 1 else '$lt'
+    if sort_field == '_id':
+        return {'_id': {op: last_id}}
+    # Missing and null values sort before every other value, so they come
+    # first in ascending order and last in descending order
+    if value is None:
+        same_value = {sort_field: None, '_id': {op: last_id}}
+        if direction == 1:
+            return {'$or': [{sort_field: {'$ne': None}}, same_value]}
+        return same_value
+    branches = [
+        {sort_field: {op: value}},
+        {sort_field: value, '_id': {op: last_id}}
+    ]
+    if direction == -1:
+        branches.append({sort_field: None})
+    return {'$or': branches}
+
+def paginate(collection, query, sort_field='_id', direction=1, limit=None,
+             cursor=None, projection=None):
+    """
+    Run a keyset-paginated find and return (documents, next_cursor).
+    Documents are ordered by (sort_field, _id) so the cursor stays stable
+    even when several documents share the same sort value.
+    """
+    if cursor:
+        value, last_id = decode_cursor(cursor)
+        query = {'$and': [query, keyset_filter(sort_field, direction, value, last_id)]}
+
+    # The cursor is built from the sort field, so the projection must keep it
+    if projection and all(projection.values()):
+        projection = {**projection, sort_field: 1}
+    elif projection:
+        projection = {field: value for field, value in projection.items() if field != sort_field}
+
+    sort = [('_id', direction)]
+    if sort_field != '_id':
+        sort.insert(0, (sort_field, direction))
+
+    find_cursor = collection.find(query, projection).sort(sort)
+    if limit is None:
+        return list(find_cursor), None
+
+    # Fetch one extra document to find out whether another page exists
+    documents = list(find_cursor.limit(limit + 1))
+    if len(documents) <= limit:
+        return documents, None
+    documents = documents[:limit]
+    return documents, encode_cursor(documents[-1], sort_field)
@@ -0,0 +1,16 @@
+def parse_fields(raw_fields, allowed_fields):
+    """
+    Turn a ?fields=title,status query value into a MongoDB inclusion projection.
+    Returns None when no fields were requested so callers fetch whole documents.
+    Dotted paths (project_manager.name) are allowed below an allowed top-level field.
+    """
+    if not raw_fields:
+        return None
+    fields = list(dict.fromkeys(f.strip() for f in raw_fields.split(',') if f.strip()))
+    unknown = [f for f in fields if f.split('.')[0] not in allowed_fields]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    # Asking for a whole subdocument and one of its paths is a path collision
+    top_level = {f for f in fields if '.' not in f}
+    return {f: 1 for f in fields if '.' not in f or f.split('.')[0] not in top_level}
@@ -0,0 +1,79 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from shared.database import mongo
+
+# Token buckets: each key holds up to `capacity` tokens, refilled at `rate`
+# tokens per second, and every attempt takes one. consume() returns
+# (allowed, retry_after_seconds).
+
+class MemoryRateLimiter:
+    """Per-process buckets; enough for a single replica"""
+
+    def __init__(self, max_keys=100000):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consume(self, key, capacity, rate):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.pop(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * rate)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            # Least recently used buckets are the ones most likely to be full again
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, 0 if allowed else math.ceil((1 - tokens) / rate)
+
+    def reset(self, key):
+        with self._lock:
+            self._buckets.pop(key, None)
+
+class MongoRateLimiter:
+    """
+    Buckets shared by every replica, stored in the rate_limits collection.
+    Refill and take happen in one atomic pipeline update; idle buckets are
+    removed by a TTL index once they would be full again.
+    """
+
+    def consume(self, key, capacity, rate):
+        now = datetime.utcnow()
+        elapsed = {'$divide': [{'$subtract': [now, {'$ifNull': ['$updated_at', now]}]}, 1000]}
+        bucket = mongo.db.rate_limits.find_one_and_update(
+            {'_id': key},
+            [
+                {'$set': {
+                    'tokens': {'$min': [capacity, {'$add': [
+                        {'$ifNull': ['$tokens', capacity]}, {'$multiply': [elapsed, rate]}
+                    ]}]},
+                    'updated_at': now,
+                    'expires_at': now + timedelta(seconds=capacity / rate)
+                }},
+                {'$set': {
+                    'allowed': {'$gte': ['$tokens', 1]},
+                    'tokens': {'$cond': [{'$gte': ['$tokens', 1]}, {'$subtract': ['$tokens', 1]}, '$tokens']}
+                }}
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        if bucket['allowed']:
+            return True, 0
+        return False, math.ceil((1 - bucket['tokens']) / rate)
+
+    def reset(self, key):
+        mongo.db.rate_limits.delete_one({'_id': key})
+
+def create_rate_limiter(backend):
+    if backend == 'mongo':
+        return MongoRateLimiter()
+    if backend == 'memory':
+        return MemoryRateLimiter()
+    raise ValueError(f"Unknown rate limit backend '{backend}'")
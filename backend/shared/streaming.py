@@ -0,0 +1,20 @@
+from flask import current_app
+
+def stream_json_array(documents, transform=None, batch_size=100):
+    """
+    Yield a JSON array chunk by chunk straight from a PyMongo cursor, so the
+    whole result never has to be held in memory or encoded in one call.
+    """
+    dumps = current_app.json.dumps
+    yield '['
+    separator = ''
+    chunk = []
+    for document in documents:
+        chunk.append(dumps(transform(document) if transform else document))
+        if len(chunk) >= batch_size:
+            yield separator + ','.join(chunk)
+            separator = ','
+            chunk = []
+    if chunk:
+        yield separator + ','.join(chunk)
+    yield ']'
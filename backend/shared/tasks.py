@@ -0,0 +1,103 @@
+import threading
+import time
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from shared.database import mongo
+from shared.config import TASK_MODE, TASK_BATCH_SIZE, TASK_MAX_ATTEMPTS, TASK_POLL_INTERVAL
+
+# Deferred work is stored in the task_outbox collection and drained in batches,
+# either by a worker thread inside each app process or by `flask run-tasks`.
+#
+# TASK_MODE:
+#   inline   - run the handler immediately inside the request
+#   thread   - enqueue and let the in-process worker thread drain the outbox
+#   external - enqueue only; a separate process drains the outbox
+
+handlers = {}
+_wakeup = threading.Event()
+_worker = None
+
+LEASE_TIMEOUT = timedelta(minutes=5)
+
+def task(kind):
+    """Register the handler run for outbox entries of the given kind"""
+    def decorator(func):
+        handlers[kind] = func
+        return func
+    return decorator
+
+def enqueue(kind, payload):
+    """Schedule a task; returns the outbox entry ID, or None if it ran inline"""
+    if kind not in handlers:
+        raise ValueError(f"No task handler registered for '{kind}'")
+
+    if TASK_MODE == 'inline':
+        handlers[kind](payload)
+        return None
+
+    now = datetime.utcnow()
+    result = mongo.db.task_outbox.insert_one({
+        'kind': kind,
+        'payload': payload,
+        'status': 'pending',
+        'attempts': 0,
+        'run_after': now,
+        'created_at': now
+    })
+    _wakeup.set()
+    return str(result.inserted_id)
+
+def claim_next():
+    """Atomically lease the next runnable task, including ones whose lease expired"""
+    now = datetime.utcnow()
+    return mongo.db.task_outbox.find_one_and_update(
+        {'$or': [
+            {'status': 'pending', 'run_after': {'$lte': now}},
+            {'status': 'running', 'locked_at': {'$lte': now - LEASE_TIMEOUT}}
+        ]},
+        {'$set': {'status': 'running', 'locked_at': now}, '$inc': {'attempts': 1}},
+        sort=[('run_after', 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def run_pending(batch_size=TASK_BATCH_SIZE):
+    """Run up to batch_size tasks and return how many were claimed"""
+    processed = 0
+    while processed < batch_size:
+        entry = claim_next()
+        if not entry:
+            break
+        processed += 1
+        try:
+            handlers[entry['kind']](entry['payload'])
+        except Exception as e:
+            print(f"Task {entry['_id']} ({entry['kind']}) failed: {str(e)}")
+            if entry['attempts'] >= TASK_MAX_ATTEMPTS:
+                update = {'$set': {'status': 'failed', 'error': str(e)}}
+            else:
+                # Exponential backoff before the next attempt
+                retry_at = datetime.utcnow() + timedelta(seconds=2 ** entry['attempts'])
+                update = {'$set': {'status': 'pending', 'run_after': retry_at, 'error': str(e)}}
+            mongo.db.task_outbox.update_one({'_id': entry['_id']}, update)
+        else:
+            mongo.db.task_outbox.delete_one({'_id': entry['_id']})
+    return processed
+
+def run_forever(poll_interval=TASK_POLL_INTERVAL):
+    while True:
+        try:
+            if run_pending():
+                continue
+        except Exception as e:
+            print(f"Task worker error: {str(e)}")
+            time.sleep(poll_interval)
+        _wakeup.wait(poll_interval)
+        _wakeup.clear()
+
+def start_worker():
+    """Start the in-process outbox worker when TASK_MODE is 'thread'"""
+    global _worker
+    if TASK_MODE != 'thread' or _worker is not None:
+        return
+    _worker = threading.Thread(target=run_forever, name='task-outbox', daemon=True)
+    _worker.start()
@@ -1,59 +1,240 @@
+import re
+from pymongo import UpdateOne
 from shared.database import mongo
+from shared.pagination import paginate
+from shared.cache import TTLCache
+from shared.tasks import task, enqueue
+from shared.config import USER_CACHE_SIZE, USER_CACHE_TTL
 from bson import ObjectId
 
+# Users looked up by email, mostly the caller of a protected route
+user_cache = TTLCache(USER_CACHE_SIZE, USER_CACHE_TTL)
+
 class UserService:
+    # Fields that may be requested through ?fields=
+    public_fields = {"_id", "name", "email", "role", "experience", "skills", "designation", "bio"}
+
+    # Sensitive or internal fields never sent to clients
+    hidden_fields = {"password": 0, "reset_token": 0, "reset_token_expires": 0,
+                     "name_lower": 0, "skills_normalized": 0, "designation_lower": 0}
+    # Maintained by the server; never accepted from profile or admin updates
+    internal_fields = ["_id", "token_version", "name_lower", "skills_normalized", "designation_lower"]
+
+    @staticmethod
+    def normalize(value):
+        return value.strip().lower()
+
+    @staticmethod
+    def skills_list(skills):
+        """Skills as a list; the profile page sends them as one comma separated string"""
+        if isinstance(skills, str):
+            skills = skills.split(",")
+        return [skill.strip() for skill in skills or [] if skill.strip()]
+
+    @staticmethod
+    def prepare_update(update_data):
+        """$set document for a user update: skills stored as a list, search fields refreshed"""
+        if "skills" in update_data:
+            update_data = {**update_data, "skills": UserService.skills_list(update_data["skills"])}
+        return {**update_data, **UserService.search_fields(update_data)}
+
+    @staticmethod
+    def search_fields(data):
+        """Normalized copies of searchable fields, stored next to the originals"""
+        fields = {}
+        if "name" in data:
+            fields["name_lower"] = UserService.normalize(data["name"]) if data["name"] else None
+        if "skills" in data:
+            fields["skills_normalized"] = sorted({
+                UserService.normalize(skill) for skill in UserService.skills_list(data["skills"])
+            })
+        if "designation" in data:
+            # Cleared designations must stop matching their old value
+            fields["designation_lower"] = (UserService.normalize(data["designation"])
+                                           if data["designation"] else None)
+        return fields
+
+    # Users whose search fields are missing or were derived incorrectly
+    # (skills saved as a string used to be split into characters)
+    stale_search_fields = {"$or": [
+        *({field: {"$exists": False}} for field in ("name_lower", "skills_normalized", "designation_lower")),
+        {"skills": {"$type": "string"}},
+        {"designation": {"$in": ["", None]}, "designation_lower": {"$ne": None}}
+    ]}
+
+    @staticmethod
+    def search_query(prefix):
+        """Case-insensitive name or email prefix match, anchored so it can use an index"""
+        if not prefix:
+            return {}
+        pattern = "^" + re.escape(prefix.strip().lower())
+        return {"$or": [{"name_lower": {"$regex": pattern}}, {"email": {"$regex": pattern}}]}
+
+    @staticmethod
+    def list_users(prefix=None, limit=None, cursor=None, projection=None):
+        """Retrieve a page of users ordered by name, excluding sensitive fields"""
+        return paginate(mongo.db.users, UserService.search_query(prefix), "name_lower", 1,
+                        limit, cursor, projection or UserService.hidden_fields)
+
+    @staticmethod
+    def search_by_skills(skills, match_all=True, designation=None, limit=20):
+        """
+        Find users by skills (all of them, or any of them) and optional designation,
+        ranked by how many of the requested skills they have.
+        """
+        skills = sorted({UserService.normalize(skill) for skill in skills if skill.strip()})
+        query = {}
+        if skills:
+            query["skills_normalized"] = {"$all" if match_all else "$in": skills}
+        if designation:
+            query["designation_lower"] = UserService.normalize(designation)
+        if not query:
+            return []
+
+        return list(mongo.db.users.aggregate([
+            {"$match": query},
+            {"$addFields": {"match_count": {"$size": {"$setIntersection": [
+                {"$ifNull": ["$skills_normalized", []]}, skills
+            ]}}}},
+            {"$sort": {"match_count": -1, "name_lower": 1, "_id": 1}},
+            {"$limit": limit},
+            {"$project": UserService.hidden_fields}
+        ]))
+
+    @staticmethod
+    def iter_users(prefix=None, projection=None, batch_size=500):
+        """Lazily iterate over users ordered by name, fetching batch_size documents per round trip"""
+        return mongo.db.users.find(
+            UserService.search_query(prefix), projection or UserService.hidden_fields
+        ).sort([("name_lower", 1), ("_id", 1)]).batch_size(batch_size)
+
+    @staticmethod
+    def backfill_search_fields(batch_size=500):
+        """Populate or repair search fields on users matching stale_search_fields"""
+        updated = 0
+        batch = []
+        for user in mongo.db.users.find(UserService.stale_search_fields,
+                                        {"name": 1, "skills": 1, "designation": 1}):
+            # Every source field is passed so each search field gets a value, even if empty
+            update = UserService.prepare_update({"name": user.get("name"),
+                                                 "skills": user.get("skills") or [],
+                                                 "designation": user.get("designation")})
+            batch.append(UpdateOne({"_id": user["_id"]}, {"$set": update}))
+            if len(batch) >= batch_size:
+                updated += mongo.db.users.bulk_write(batch, ordered=False).modified_count
+                batch = []
+        if batch:
+            updated += mongo.db.users.bulk_write(batch, ordered=False).modified_count
+        return updated
+
     @staticmethod
-    def get_all_users():
-        """Retrieve all users excluding sensitive fields"""
-        return list(mongo.db.users.find({}, 
-            {"password": 0, "reset_token": 0, "reset_token_expires": 0}))
+    def schedule_search_backfill():
+        """Queue backfill_search_fields at startup while any user has stale search fields"""
+        if mongo.db.users.find_one(UserService.stale_search_fields, {"_id": 1}):
+            enqueue("user_search_backfill", {})
 
     @staticmethod
     def get_user_by_id(user_id):
         """Retrieve a specific user by ID"""
         return mongo.db.users.find_one(
             {"_id": ObjectId(user_id)},
-            {"password": 0, "reset_token": 0, "reset_token_expires": 0}
+            UserService.hidden_fields
         )
-    
+
+    @staticmethod
+    def get_users_by_ids(user_ids, fields=None):
+        """
+        Retrieve several users in a single $in query.
+        Returns a dict keyed by the string user ID; unknown IDs are left out.
+        """
+        object_ids = list({ObjectId(user_id) for user_id in user_ids})
+        if not object_ids:
+            return {}
+        if fields:
+            projection = {field: 1 for field in fields}
+        else:
+            projection = UserService.hidden_fields
+        users = mongo.db.users.find({"_id": {"$in": object_ids}}, projection)
+        return {str(user["_id"]): user for user in users}
+
+    @staticmethod
+    def to_member(user):
+        """Embedded user snapshot stored on projects"""
+        return {
+            'user_id': str(user['_id']),
+            'email': user['email'],
+            'name': user['name']
+        }
     
     @staticmethod
-    def get_user_by_email(email):
-        """Retrieve a specific user by ID"""
+    def get_snapshot_source(email):
+        """
+        The user's current _id, name, email and role, read past user_cache:
+        another worker may still cache the name from before a profile change
+        """
         return mongo.db.users.find_one(
             {"email": email},
-            {"password": 0, "reset_token": 0, "reset_token_expires": 0}
+            {"name": 1, "email": 1, "role": 1}
         )
 
+    @staticmethod
+    def get_user_by_email(email):
+        """Retrieve a specific user by email, served from user_cache when possible"""
+        user = user_cache.get(email)
+        if user is None:
+            user = mongo.db.users.find_one(
+                {"email": email},
+                UserService.hidden_fields
+            )
+            if user:
+                user_cache.set(email, user)
+        return user
+
+    @staticmethod
+    def invalidate_cached_user(user_id):
+        """Drop a user from user_cache after it was changed by ID"""
+        user_cache.invalidate_where(lambda user: str(user["_id"]) == str(user_id))
+
     @staticmethod
     def update_user_profile(email, update_data):
         """Update user profile data"""
-        return mongo.db.users.update_one(
+        result = mongo.db.users.update_one(
             {"email": email},
-            {"$set": update_data}
+            {"$set": UserService.prepare_update(update_data)}
         )
+        user_cache.invalidate(email)
+        return result
 
     @staticmethod
     def delete_user(user_id):
         """Delete a user by ID"""
-        return mongo.db.users.delete_one({"_id": ObjectId(user_id)})
+        result = mongo.db.users.delete_one({"_id": ObjectId(user_id)})
+        UserService.invalidate_cached_user(user_id)
+        return result
 
     @staticmethod
     def sanitize_update_data(data):
         """Remove protected fields from update data"""
-        protected_fields = ["email", "password", "role", "reset_token", "reset_token_expires"]
+        protected_fields = ["email", "password", "role", "reset_token", "reset_token_expires",
+                            *UserService.internal_fields]
         return {k: v for k, v in data.items() if k not in protected_fields}
 
     @staticmethod
     def update_user_by_id(user_id, update_data):
-        """Update user by ID (admin only)"""
-        return mongo.db.users.update_one(
+        """Update user by ID (admin only); also used by the role PATCH"""
+        result = mongo.db.users.update_one(
             {"_id": ObjectId(user_id)},
-            {"$set": update_data}
+            {"$set": UserService.prepare_update(update_data)}
         )
+        UserService.invalidate_cached_user(user_id)
+        return result
 
     @staticmethod
     def sanitize_admin_update_data(data):
         """Remove protected fields for admin update"""
-        protected_fields = ["password", "reset_token", "reset_token_expires"]
-        return {k: v for k, v in data.items() if k not in protected_fields} 
\ No newline at end of file
+        protected_fields = ["password", "reset_token", "reset_token_expires", *UserService.internal_fields]
+        return {k: v for k, v in data.items() if k not in protected_fields} 
+
+@task("user_search_backfill")
+def backfill_user_search_fields(payload):
+    UserService.backfill_search_fields()
@@ -0,0 +1,85 @@
+import time
+from bson import ObjectId
+from shared.database import mongo
+from shared.tasks import task, enqueue
+from shared.config import PROPAGATION_BATCH_SIZE, PROPAGATION_PAUSE
+from projects.models import Project
+
+# User name and email are copied into projects, comments and knowledge base
+# items. After a profile change this task rewrites the stale copies in
+# throttled batches. Every step only matches copies that are still stale, so
+# a retried or interrupted run resumes where it stopped, and the current
+# name/email are read when the task runs so an older task never wins.
+
+def schedule_snapshot_propagation(user_id):
+    return enqueue('user_snapshot_propagation', {'user_id': str(user_id)})
+
+def stale(name_field, email_field, name, email):
+    return {'$or': [{name_field: {'$ne': name}}, {email_field: {'$ne': email}}]}
+
+def propagation_steps(user):
+    user_id, object_id = str(user['_id']), user['_id']
+    name, email = user['name'], user['email']
+    return [
+        ('projects',
+         {'team_members': {'$elemMatch': {'user_id': user_id, **stale('name', 'email', name, email)}}},
+         {'$set': {'team_members.$[member].name': name, 'team_members.$[member].email': email}},
+         [{'member.user_id': user_id}]),
+        ('projects',
+         {'interested_users': {'$elemMatch': {'user_id': user_id, **stale('name', 'email', name, email)}}},
+         {'$set': {'interested_users.$[member].name': name, 'interested_users.$[member].email': email}},
+         [{'member.user_id': user_id}]),
+        ('projects',
+         {'project_manager.user_id': user_id,
+          **stale('project_manager.name', 'project_manager.email', name, email)},
+         {'$set': {'project_manager.name': name, 'project_manager.email': email}},
+         None),
+        ('comments',
+         {'user_id': object_id, **stale('user_name', 'user_email', name, email)},
+         {'$set': {'user_name': name, 'user_email': email}},
+         None),
+        ('comments',
+         {'replies': {'$elemMatch': {'user_id': object_id,
+                                     **stale('user_name', 'user_email', name, email)}}},
+         {'$set': {'replies.$[reply].user_name': name, 'replies.$[reply].user_email': email}},
+         [{'reply.user_id': object_id}]),
+        ('comment_replies',
+         {'user_id': object_id, **stale('user_name', 'user_email', name, email)},
+         {'$set': {'user_name': name, 'user_email': email}},
+         None),
+        ('knowledge_base',
+         {'created_by.user_id': user_id, **stale('created_by.name', 'created_by.email', name, email)},
+         {'$set': {'created_by.name': name, 'created_by.email': email}},
+         None),
+    ]
+
+def apply_in_batches(collection, query, update, array_filters):
+    """Rewrite matching documents PROPAGATION_BATCH_SIZE at a time, pausing between batches"""
+    modified = 0
+    while True:
+        ids = [doc['_id'] for doc in collection.find(query, {'_id': 1}).limit(PROPAGATION_BATCH_SIZE)]
+        if not ids:
+            break
+        result = collection.update_many({'_id': {'$in': ids}}, update, array_filters=array_filters)
+        modified += result.modified_count
+        if len(ids) < PROPAGATION_BATCH_SIZE or result.modified_count == 0:
+            break
+        time.sleep(PROPAGATION_PAUSE)
+    return modified
+
+@task('user_snapshot_propagation')
+def propagate_user_snapshot(payload):
+    user = mongo.db.users.find_one({'_id': ObjectId(payload['user_id'])}, {'name': 1, 'email': 1})
+    if not user:
+        return
+
+    projects_modified = 0
+    for collection, query, update, array_filters in propagation_steps(user):
+        if collection == 'projects':
+            # Keep project ETags honest: a rewritten snapshot is a new version
+            update = {**update, '$inc': {'version': 1}}
+        modified = apply_in_batches(mongo.db[collection], query, update, array_filters)
+        if collection == 'projects':
+            projects_modified += modified
+    if projects_modified:
+        Project.bump_collection_version()
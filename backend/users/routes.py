@@ -1,21 +1,68 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from auth.models import User
+from auth.jwt_utils import generate_token, get_current_user, revoke_tokens, token_version_cache
 from users.models import UserService
+from users.propagation import schedule_snapshot_propagation
 from bson import ObjectId
+from shared.projection import parse_fields
+from shared.pagination import DEFAULT_PAGE_SIZE, parse_limit
+from shared.streaming import stream_json_array
 
 users = Blueprint("users", __name__)
 
 @users.route("/users", methods=["GET"])
 @jwt_required()
 def get_all_users():
-    users_list = UserService.get_all_users()
+    try:
+        projection = parse_fields(request.args.get('fields'), UserService.public_fields)
+        limit = parse_limit(request.args.get('limit'))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    prefix = request.args.get('q')
+
+    # ?stream=true sends the directory as it is read from the database cursor
+    if request.args.get('stream', '').lower() == 'true':
+        users_cursor = UserService.iter_users(prefix, projection)
+        return Response(
+            stream_with_context(stream_json_array(users_cursor, serialize_user)),
+            mimetype="application/json"
+        )
+
+    try:
+        users_list, next_cursor = UserService.list_users(
+            prefix, limit, request.args.get('cursor'), projection
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     
     # Convert ObjectId to string for JSON serialization
-    for user in users_list:
-        user["_id"] = str(user["_id"])
-    
-    return jsonify(users_list), 200
+    response = jsonify([serialize_user(user) for user in users_list])
+    # The body stays a plain array; the next page is advertised in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response, 200
+
+def serialize_user(user):
+    user["_id"] = str(user["_id"])
+    user.pop("name_lower", None)
+    return user
+
+@users.route("/users/search", methods=["GET"])
+@jwt_required()
+def search_users():
+    # ?skills=python,kubernetes&match=all|any&designation=...
+    skills = [skill for skill in request.args.get('skills', '').split(',') if skill.strip()]
+    designation = request.args.get('designation')
+    if not skills and not designation:
+        return jsonify({"error": "skills or designation is required"}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'), DEFAULT_PAGE_SIZE)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    match_all = request.args.get('match', 'all').lower() != 'any'
+    users_list = UserService.search_by_skills(skills, match_all, designation, limit)
+    return jsonify({"users": [serialize_user(user) for user in users_list]}), 200
 
 @users.route("/users/<user_id>", methods=["GET"])
 @jwt_required()
@@ -46,15 +93,21 @@ def update_profile():
     result = UserService.update_user_profile(current_user_email, update_data)
     
     if result.modified_count:
-        return jsonify({"message": "Profile updated successfully"}), 200
+        response = {"message": "Profile updated successfully"}
+        # The name is a token claim; hand back a token that carries the new one
+        if "name" in update_data:
+            user = UserService.get_user_by_email(current_user_email)
+            response["access_token"] = generate_token(user)
+            # Refresh the copies of the name held by projects, comments, etc.
+            schedule_snapshot_propagation(user["_id"])
+        return jsonify(response), 200
     return jsonify({"error": "Failed to update profile"}), 400
 
 @users.route("/users/<user_id>", methods=["DELETE"])
 @jwt_required()
 def delete_user(user_id):
     # Get current user's role
-    current_user_email = get_jwt_identity()
-    current_user = User.find_by_email(current_user_email)
+    current_user = get_current_user()
     
     if not current_user or current_user.get("role") != "admin":
         return jsonify({"error": "Unauthorized access"}), 403
@@ -62,6 +115,8 @@ def delete_user(user_id):
     try:
         result = UserService.delete_user(user_id)
         if result.deleted_count:
+            # Outstanding tokens of the deleted user fail the token_version check
+            token_version_cache.invalidate(user_id)
             return jsonify({"message": "User deleted successfully"}), 200
         return jsonify({"error": "User not found"}), 404
     except:
@@ -71,8 +126,7 @@ def delete_user(user_id):
 @jwt_required()
 def update_user(user_id):
     # Get current user's role
-    current_user_email = get_jwt_identity()
-    current_user = User.find_by_email(current_user_email)
+    current_user = get_current_user()
     
     # Check if user is admin
     if not current_user or current_user.get("role") != "admin":
@@ -91,6 +145,11 @@ def update_user(user_id):
         result = UserService.update_user_by_id(user_id, update_data)
         
         if result.modified_count:
+            # Tokens carry role, name and email; make the user sign in again
+            if {"role", "name", "email"} & update_data.keys():
+                revoke_tokens(user_id)
+            if {"name", "email"} & update_data.keys():
+                schedule_snapshot_propagation(user_id)
             return jsonify({"message": "User updated successfully"}), 200
         return jsonify({"error": "User not found or no changes made"}), 404
     except Exception as e:
@@ -100,8 +159,7 @@ def update_user(user_id):
 @jwt_required()
 def update_user_role(user_id):
     # Get current user's role
-    current_user_email = get_jwt_identity()
-    current_user = User.find_by_email(current_user_email)
+    current_user = get_current_user()
     
     # Check if user is admin
     if not current_user or current_user.get("role") != "admin":
@@ -117,6 +175,7 @@ def update_user_role(user_id):
         result = UserService.update_user_by_id(user_id, update_data)
         
         if result.modified_count:
+            revoke_tokens(user_id)
             return jsonify({"message": "User role updated successfully"}), 200
         return jsonify({"error": "User not found or no changes made"}), 404
     except Exception as e: